@@ -1,59 +1,70 @@
+import os
+
+import numpy as np
 import pandas as pd
-import haversine as hs
-import networkx as nx
 
-from scipy import stats
-from haversine import Unit
+from scipy.sparse.csgraph import dijkstra
+
+from Geo import haversine_distance
+from Network import build_metro_network
 
 
 
-def add_haversine_distance_col(scrapped_fare_df, stops_df, len_purple_line, len_green_line):
-    stop_dict = {stops_df["stop_name"].iloc[row]: [stops_df["stop_id"].iloc[row], (stops_df["stop_lat"].iloc[row], stops_df["stop_lon"].iloc[row])] for row in range(0, len_purple_line+len_green_line)}
+def add_haversine_distance_col(scrapped_fare_df, stop_registry):
+    # the scrapped fares are for the present purple and green lines only
+    old_metro_slice = slice(stop_registry.line_offsets['M_P'][0], stop_registry.line_offsets['M_G'][1])
+    stop_dict = {stop_name: [stop_id, (lat, lon)] for stop_name, stop_id, lat, lon in zip(stop_registry.stop_names[old_metro_slice], stop_registry.stop_ids[old_metro_slice], stop_registry.stop_lat[old_metro_slice], stop_registry.stop_lon[old_metro_slice])}
 
-    haversine_dis = []
-    for row in range(scrapped_fare_df.shape[0]):
-        loc1 = stop_dict[scrapped_fare_df["source_stop"].iloc[row]][1]
-        loc2 = stop_dict[scrapped_fare_df["destination_stop"].iloc[row]][1]
-        haversine_dis.append(hs.haversine(loc1, loc2, unit=Unit.METERS))
+    source_locations = np.array([stop_dict[stop_name][1] for stop_name in scrapped_fare_df["source_stop"]]).reshape(-1, 2)
+    destination_locations = np.array([stop_dict[stop_name][1] for stop_name in scrapped_fare_df["destination_stop"]]).reshape(-1, 2)
 
-    scrapped_fare_df["haversine_distance"] = haversine_dis
+    scrapped_fare_df["haversine_distance"] = haversine_distance(source_locations[:, 0], source_locations[:, 1], destination_locations[:, 0], destination_locations[:, 1])
 
     return scrapped_fare_df, stop_dict
 
 
-def get_old_metro_network(stops_df, len_purple_line, len_green_line):
-    stop_dict = {stops_df["stop_id"].iloc[row]: (stops_df["stop_lat"].iloc[row], stops_df["stop_lon"].iloc[row]) for row in range(0, len_purple_line + len_green_line)}
+def get_old_metro_network(stop_registry, interchange_df):
+    # network of the present purple and green lines, on which the scrapped fares are charged
+    return build_metro_network(stop_registry, interchange_df, ['M_P', 'M_G'])
 
-    purple_line_stop_ids = list(stops_df["stop_id"].iloc[: len_purple_line])
-    green_line_stop_ids = list(stops_df["stop_id"].iloc[len_purple_line : len_purple_line + len_green_line])
 
-    g = nx.Graph()
-    g.add_nodes_from(purple_line_stop_ids + green_line_stop_ids)
+def get_distance_matrix(metro_network):
+    # one multi-source dijkstra over the sparse adjacency matrix gives the shortest network distance between every pair of stops,
+    # explicit zeros in the sparse matrix are kept as zero weight interchange edges
+    distance_matrix = dijkstra(metro_network.adjacency, directed=False)
 
-    g.add_edges_from([(purple_line_stop_ids[x-1], purple_line_stop_ids[x], {'weight': hs.haversine(stop_dict[purple_line_stop_ids[x-1]], stop_dict[purple_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(purple_line_stop_ids))])
-    g.add_edges_from([(green_line_stop_ids[x-1], green_line_stop_ids[x], {'weight': hs.haversine(stop_dict[green_line_stop_ids[x-1]], stop_dict[green_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(green_line_stop_ids))])
+    return distance_matrix, metro_network.stop_index
 
-    g.add_edges_from([('M_P_23', 'M_G_17', {'weight': 0})])
 
-    return g
+def add_actual_distance_col(scrapped_fare_df, stop_dict, distance_matrix, stop_index):
+    # the stop names are mapped to their rows of the distance matrix, so every distance is read with one fancy index
+    stop_name_index = {stop_name: stop_index[stop_id] for stop_name, (stop_id, location) in stop_dict.items()}
+    source = scrapped_fare_df["source_stop"].map(stop_name_index).to_numpy(dtype='int64')
+    destination = scrapped_fare_df["destination_stop"].map(stop_name_index).to_numpy(dtype='int64')
 
+    scrapped_fare_df["actual_distance"] = distance_matrix[source, destination]
 
-def add_actual_distance_col(scrapped_fare_df, stop_dict, G):
-    actual_distance = []
-    for row in range(scrapped_fare_df.shape[0]):
-        actual_distance.append(nx.shortest_path_length(G, source=stop_dict[scrapped_fare_df["source_stop"].iloc[row]][0], target=stop_dict[scrapped_fare_df["destination_stop"].iloc[row]][0], weight='weight', method='dijkstra'))
+    return scrapped_fare_df
 
-    scrapped_fare_df["actual_distance"] = actual_distance
+def least_squares_fit(x, y):
+    # slope, intercept and standard error of the slope of the least squares line, computed the same way as scipy.stats.linregress so the fares do not change,
+    # importing scipy.stats for this one fit took longer than the whole fare stage
+    ssxm, ssxym, _, ssym = np.cov(x, y, bias=1).flat
+    r = np.clip(ssxym / np.sqrt(ssxm * ssym), -1.0, 1.0)
 
-    return scrapped_fare_df
+    slope = ssxym / ssxm
+    intercept = np.mean(y) - slope * np.mean(x)
+    std_err = np.sqrt((1 - r**2) * ssym / ssxm / (len(x) - 2)) if len(x) > 2 else 0.0
+
+    return slope, intercept, std_err
 
 def linear_regression(scrapped_fare_df):
-    haversine_distance = list(scrapped_fare_df["haversine_distance"])
-    actual_distance = list(scrapped_fare_df["actual_distance"])
-    fare = list(scrapped_fare_df["fare"])
+    haversine_distances = scrapped_fare_df["haversine_distance"].to_numpy(dtype='float64')
+    actual_distances = scrapped_fare_df["actual_distance"].to_numpy(dtype='float64')
+    fares = scrapped_fare_df["fare"].to_numpy(dtype='float64')
 
-    slope_haversine, intercept_haversine, r_haversine, p_haversine, std_err_haversine = stats.linregress(haversine_distance, fare)
-    slope_actual, intercept_actual, r_actual, p_actual, std_err_actual = stats.linregress(actual_distance, fare)
+    slope_haversine, intercept_haversine, std_err_haversine = least_squares_fit(haversine_distances, fares)
+    slope_actual, intercept_actual, std_err_actual = least_squares_fit(actual_distances, fares)
 
     if std_err_haversine < std_err_actual:
         return slope_haversine, intercept_haversine
@@ -61,62 +72,58 @@ def linear_regression(scrapped_fare_df):
         return slope_actual, intercept_actual
 
 
-def get_new_metro_network(stops_df, len_purple_line, len_green_line, len_orange_line, len_yellow_line, len_silver_line, len_red_line, len_blue_line, len_pink_line):
-    stop_dict = {stops_df["stop_id"].iloc[row] : (stops_df["stop_lat"].iloc[row], stops_df["stop_lon"].iloc[row]) for row in range(stops_df.shape[0])}
-
-    purple_line_stop_ids = list(stops_df["stop_id"].iloc[: len_purple_line])
-    green_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line):(len_purple_line + len_green_line)])
-    orange_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line):(len_purple_line + len_green_line + len_orange_line)])
-    yellow_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line + len_orange_line):(len_purple_line + len_green_line + len_orange_line + len_yellow_line)])
-    silver_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line + len_orange_line + len_yellow_line):(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line)])
-    red_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line):(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line + len_red_line)])
-    blue_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line + len_red_line):(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line + len_red_line + len_blue_line)])
-    pink_line_stop_ids = list(stops_df["stop_id"].iloc[(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line + len_red_line + len_blue_line):(len_purple_line + len_green_line + len_orange_line + len_yellow_line + len_silver_line + len_red_line + len_blue_line + len_pink_line)])
-
-    g = nx.Graph()
-    g.add_nodes_from(purple_line_stop_ids + green_line_stop_ids + orange_line_stop_ids + yellow_line_stop_ids + silver_line_stop_ids + red_line_stop_ids + blue_line_stop_ids + pink_line_stop_ids)
-
-    g.add_edges_from([(purple_line_stop_ids[x-1], purple_line_stop_ids[x], {'weight': hs.haversine(stop_dict[purple_line_stop_ids[x-1]], stop_dict[purple_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(purple_line_stop_ids))])
-    g.add_edges_from([(green_line_stop_ids[x-1], green_line_stop_ids[x], {'weight': hs.haversine(stop_dict[green_line_stop_ids[x-1]], stop_dict[green_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(green_line_stop_ids))])
-    g.add_edges_from([(orange_line_stop_ids[x-1], orange_line_stop_ids[x], {'weight': hs.haversine(stop_dict[orange_line_stop_ids[x-1]], stop_dict[orange_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(orange_line_stop_ids))])
-    g.add_edges_from([(yellow_line_stop_ids[x-1], yellow_line_stop_ids[x], {'weight': hs.haversine(stop_dict[yellow_line_stop_ids[x-1]], stop_dict[yellow_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(yellow_line_stop_ids))])
-    g.add_edges_from([(silver_line_stop_ids[x-1], silver_line_stop_ids[x], {'weight': hs.haversine(stop_dict[silver_line_stop_ids[x-1]], stop_dict[silver_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(silver_line_stop_ids))])
-    g.add_edges_from([(red_line_stop_ids[x-1], red_line_stop_ids[x], {'weight': hs.haversine(stop_dict[red_line_stop_ids[x-1]], stop_dict[red_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(red_line_stop_ids))])
-    g.add_edges_from([(blue_line_stop_ids[x-1], blue_line_stop_ids[x], {'weight': hs.haversine(stop_dict[blue_line_stop_ids[x-1]], stop_dict[blue_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(blue_line_stop_ids))])
-    g.add_edges_from([(pink_line_stop_ids[x-1], pink_line_stop_ids[x], {'weight': hs.haversine(stop_dict[pink_line_stop_ids[x-1]], stop_dict[pink_line_stop_ids[x]], unit=Unit.METERS)}) for x in range(1, len(pink_line_stop_ids))])
-
-    g.add_edges_from([('M_P_30', 'M_O_8', {'weight': 0}), ('M_P_23', 'M_G_17', {'weight': 0}), ('M_P_22', 'M_R_8', {'weight': 0}), ('M_P_19', 'M_Pi_11', {'weight': 0}), ('M_P_12', 'M_B_13', {'weight': 0}), ('M_P_26', 'M_S_1', {'weight': 0})])
-    g.add_edges_from([('M_G_26', 'M_O_3', {'weight': 0}), ('M_G_24', 'M_Y_1', {'weight': 0}), ('M_G_8', 'M_O_17', {'weight': 0})])
-    g.add_edges_from([('M_O_1', 'M_Pi_4', {'weight': 0}), ('M_O_22', 'M_R_1', {'weight': 0}), ('M_O_22', 'M_B_22', {'weight': 0}), ('M_O_13', 'M_S_4', {'weight': 0})])
-    g.add_edges_from([('M_Y_3', 'M_Pi_5,', {'weight': 0}), ('M_Y_5', 'M_B_1,', {'weight': 0})])
-    g.add_edges_from([('M_R_18', 'M_B_4', {'weight': 0}), ('M_R_17', 'M_B_3', {'weight': 0}), ('M_R_12', 'M_Pi_7', {'weight': 0}), ('M_R_1', 'M_B_22', {'weight': 0})])
-    g.add_edges_from([('M_B_20', 'M_Pi_18', {'weight': 0})])
-
-    return g
-
-def create_fare_files(stops_df, scrapped_fare_df, G, slope, intercept):
-    stop_id_name_dict = {stops_df["stop_id"].iloc[row]: stops_df["stop_name"].iloc[row] for row in range(stops_df.shape[0])}
-    actual_fare_dict = {(scrapped_fare_df["source_stop"].iloc[row], scrapped_fare_df["destination_stop"].iloc[row]): scrapped_fare_df["fare"].iloc[row] for row in range(scrapped_fare_df.shape[0])}
-
-    stop_ids_list = list(stops_df["stop_id"])
-    fare_id = []
-    origin_id = []
-    destination_id = []
-    cost_li = []
-    fare_id_index = 1
-    for source in range(len(stop_ids_list)):
-        for destination in range(len(stop_ids_list)):
-            if stop_ids_list[source] != stop_ids_list[destination]:
-                distance = nx.shortest_path_length(G, source=stop_ids_list[source], target=stop_ids_list[destination],weight='weight', method='dijkstra')
-                fare = round((slope * distance) + intercept, 0)
-                fare_id.append(f'M_F_{fare_id_index}')
-                fare_id_index += 1
-                cost_li.append(actual_fare_dict.get((stop_id_name_dict[stop_ids_list[source]], stop_id_name_dict[stop_ids_list[destination]]), fare))
-                origin_id.append(stop_ids_list[source])
-                destination_id.append(stop_ids_list[destination])
-
-    fare_rule_df = pd.DataFrame(list(zip(fare_id, origin_id, destination_id)), columns=['fare_id', 'origin_id', 'destination_id'])
-    fare_attribute_df = pd.DataFrame(list(zip(fare_id, cost_li)), columns=['fare_id', 'fare'])
+def get_new_metro_network(stop_registry, interchange_df):
+    return build_metro_network(stop_registry, interchange_df)
+
+def get_fare_matrix(stop_registry, scrapped_fare_df, distance_matrix, stop_index, slope, intercept):
+    # regression fare for every ordered pair of stops in the order of the stop registry
+    stop_order = np.array([stop_index[stop_id] for stop_id in stop_registry.stop_ids])
+    fare_matrix = np.round((slope * distance_matrix[np.ix_(stop_order, stop_order)]) + intercept, 0)
+
+    # overlaying the scrapped fares, a stop name present on more than one line gets the scrapped fare at every matching stop_id
+    stop_position_df = pd.DataFrame({'stop_name': stop_registry.stop_names, 'position': np.arange(len(stop_registry))})
+    actual_fare_df = scrapped_fare_df[["source_stop", "destination_stop", "fare"]].drop_duplicates(subset=["source_stop", "destination_stop"], keep='last')
+    actual_fare_df = actual_fare_df.merge(stop_position_df.rename(columns={'stop_name': 'source_stop', 'position': 'source'}), on='source_stop')
+    actual_fare_df = actual_fare_df.merge(stop_position_df.rename(columns={'stop_name': 'destination_stop', 'position': 'destination'}), on='destination_stop')
+
+    np.put(fare_matrix, actual_fare_df["source"].to_numpy() * len(stop_registry) + actual_fare_df["destination"].to_numpy(), actual_fare_df["fare"].to_numpy())
+
+    return fare_matrix
+
+
+def iter_fare_file_chunks(stop_ids, fare_matrix, origins_per_chunk=16):
+    # rows of fare_rule and fare_attribute for a block of origins at a time, the fare_ids continue from one block to the next
+    number_of_stops = stop_ids.shape[0]
+
+    for start in range(0, number_of_stops, origins_per_chunk):
+        end = min(start + origins_per_chunk, number_of_stops)
+        off_diagonal = (np.arange(start, end)[:, np.newaxis] != np.arange(number_of_stops)[np.newaxis, :]).ravel()
+
+        origin_id = np.repeat(stop_ids[start:end], number_of_stops)[off_diagonal]
+        destination_id = np.tile(stop_ids, end - start)[off_diagonal]
+        fare = fare_matrix[start:end].ravel()[off_diagonal]
+        fare_id = np.char.add('M_F_', np.arange(start * (number_of_stops - 1) + 1, start * (number_of_stops - 1) + fare.shape[0] + 1).astype(str))
+
+        yield pd.DataFrame({'fare_id': fare_id, 'origin_id': origin_id, 'destination_id': destination_id}), pd.DataFrame({'fare_id': fare_id, 'fare': fare})
+
+
+def create_fare_files(stop_registry, scrapped_fare_df, distance_matrix, stop_index, slope, intercept):
+    fare_matrix = get_fare_matrix(stop_registry, scrapped_fare_df, distance_matrix, stop_index, slope, intercept)
+
+    fare_rule_df, fare_attribute_df = next(iter_fare_file_chunks(stop_registry.stop_ids, fare_matrix, origins_per_chunk=len(stop_registry)))
 
     return fare_rule_df, fare_attribute_df
 
+
+def save_fare_matrices(fare_matrix_path, stop_registry, fare_matrix, distance_matrix, stop_index):
+    # dense int16 fare and float32 distance matrices in stop registry order, memory-mapped by FareTable of FareService.py
+    # every file is written beside the old one and then replaces it, so a running fare service keeps its mapping of the old file
+    os.makedirs(fare_matrix_path, exist_ok=True)
+
+    stop_order = np.array([stop_index[stop_id] for stop_id in stop_registry.stop_ids])
+    fare_lookup_matrix = np.rint(fare_matrix).astype('int16')
+    np.fill_diagonal(fare_lookup_matrix, 0)
+
+    for file_name, matrix in [('fare_matrix', fare_lookup_matrix), ('distance_matrix', distance_matrix[np.ix_(stop_order, stop_order)].astype('float32')), ('stop_ids', stop_registry.stop_ids.astype(str))]:
+        np.save(f"{fare_matrix_path}/{file_name}.tmp.npy", matrix)
+        os.replace(f"{fare_matrix_path}/{file_name}.tmp.npy", f"{fare_matrix_path}/{file_name}.npy")
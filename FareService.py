@@ -0,0 +1,184 @@
+'''
+This file contain the fare lookup service. The fare stage of main saves the fare and network distance between every pair of stops as dense matrices in ".npy" files,
+FareTable memory-maps them, so opening it costs next to nothing and every lookup is a single array index. Only numpy is imported, not pandas or scipy.
+
+Usage:
+    python FareService.py M_P_1 M_G_5               prints the fare and distance from M_P_1 to M_G_5
+    python FareService.py --serve --port 8000       answers GET /fare?origin_id=M_P_1&destination_id=M_G_5 and POST /fares with [[origin_id, destination_id], ...]
+'''
+
+
+
+import argparse
+import json
+
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+FARE_MATRIX_PATH = "./fare_matrix"
+
+
+class FareTable:
+    '''
+    Fare and network distance between every pair of stops, read from the files written by save_fare_matrices function of Fare.py.
+
+    Args:
+        fare_matrix_path (str): path of folder containing stop_ids.npy, fare_matrix.npy and distance_matrix.npy.
+
+    Attributes:
+        stop_ids (numpy.ndarray): stop_id of every row and column of the matrices.
+        stop_index (dict): stop_id mapped to its row and column.
+        fare_matrix (numpy.memmap): int16 fare from the row stop to the column stop, 0 on the diagonal.
+        distance_matrix (numpy.memmap): float32 network distance in meters from the row stop to the column stop.
+
+    '''
+
+    def __init__(self, fare_matrix_path: str = FARE_MATRIX_PATH):
+        self.stop_ids = np.load(f"{fare_matrix_path}/stop_ids.npy")
+        self.stop_index = {stop_id: index for index, stop_id in enumerate(self.stop_ids.tolist())}
+        self.fare_matrix = np.load(f"{fare_matrix_path}/fare_matrix.npy", mmap_mode='r')
+        self.distance_matrix = np.load(f"{fare_matrix_path}/distance_matrix.npy", mmap_mode='r')
+
+    def get_stop_positions(self, stop_ids):
+        try:
+            return np.array([self.stop_index[stop_id] for stop_id in stop_ids], dtype='int64')
+        except KeyError as error:
+            raise KeyError(f"unknown stop_id {error.args[0]}") from None
+        except TypeError:
+            # unhashable ids such as lists can not be stop_ids either
+            raise KeyError(f"unknown stop_id {next(stop_id for stop_id in stop_ids if not isinstance(stop_id, str))!r}") from None
+
+    def fare(self, origin_id: str, destination_id: str):
+        '''
+        Returns the fare from origin_id to destination_id.
+        '''
+
+        origin, destination = self.get_stop_positions([origin_id, destination_id])
+
+        return int(self.fare_matrix[origin, destination])
+
+    def distance(self, origin_id: str, destination_id: str):
+        '''
+        Returns the network distance in meters from origin_id to destination_id.
+        '''
+
+        origin, destination = self.get_stop_positions([origin_id, destination_id])
+
+        return float(self.distance_matrix[origin, destination])
+
+    def fares(self, origin_ids, destination_ids):
+        '''
+        Returns the fares of many journeys at once, the fare of journey i is from origin_ids[i] to destination_ids[i].
+        '''
+
+        return self.fare_matrix[self.get_stop_positions(origin_ids), self.get_stop_positions(destination_ids)]
+
+    def distances(self, origin_ids, destination_ids):
+        '''
+        Returns the network distances in meters of many journeys at once, the distance of journey i is from origin_ids[i] to destination_ids[i].
+        '''
+
+        return self.distance_matrix[self.get_stop_positions(origin_ids), self.get_stop_positions(destination_ids)]
+
+    def fares_from(self, origin_id: str):
+        '''
+        Returns the fares from origin_id to every stop, in the order of stop_ids.
+        '''
+
+        return self.fare_matrix[self.get_stop_positions([origin_id])[0]]
+
+
+def serve(fare_table: FareTable, host: str = "127.0.0.1", port: int = 8000):
+    '''
+    This function answers fare lookups over HTTP with json responses until interrupted.
+        GET /fare?origin_id=...&destination_id=...  returns {"origin_id", "destination_id", "fare", "distance"}
+        POST /fares with a json list of [origin_id, destination_id] pairs  returns {"fares": [...], "distances": [...]}
+    An unknown stop_id is answered with status 404.
+
+    Args:
+        fare_table (FareTable): the fares to look up.
+        host (str): address to listen on.
+        port (int): port to listen on.
+
+    Returns:
+        None
+
+    '''
+
+    class FareRequestHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, body):
+            response = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(response)))
+            self.end_headers()
+            self.wfile.write(response)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != "/fare":
+                return self.send_json(404, {"error": "not found"})
+
+            query = parse_qs(url.query)
+            if "origin_id" not in query or "destination_id" not in query:
+                return self.send_json(400, {"error": "origin_id and destination_id are required"})
+
+            origin_id, destination_id = query["origin_id"][0], query["destination_id"][0]
+            try:
+                self.send_json(200, {"origin_id": origin_id, "destination_id": destination_id,
+                                     "fare": fare_table.fare(origin_id, destination_id), "distance": fare_table.distance(origin_id, destination_id)})
+            except KeyError as error:
+                self.send_json(404, {"error": error.args[0]})
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/fares":
+                return self.send_json(404, {"error": "not found"})
+
+            try:
+                pairs = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                # a json object or a pair which is not a list of two would otherwise be unpacked into parts of its strings
+                if not isinstance(pairs, list) or not all(isinstance(pair, list) and len(pair) == 2 for pair in pairs):
+                    raise TypeError("pairs must be [origin_id, destination_id] lists")
+                origin_ids = [origin_id for origin_id, destination_id in pairs]
+                destination_ids = [destination_id for origin_id, destination_id in pairs]
+                if not all(isinstance(stop_id, str) for stop_id in origin_ids + destination_ids):
+                    raise TypeError("stop_ids must be strings")
+            except (ValueError, TypeError):
+                return self.send_json(400, {"error": "body must be a json list of [origin_id, destination_id] pairs"})
+
+            try:
+                self.send_json(200, {"fares": fare_table.fares(origin_ids, destination_ids).tolist(),
+                                     "distances": fare_table.distances(origin_ids, destination_ids).tolist()})
+            except KeyError as error:
+                self.send_json(404, {"error": error.args[0]})
+
+    with ThreadingHTTPServer((host, port), FareRequestHandler) as server:
+        server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Look up metro fares from the fare matrix written by main.py.")
+    parser.add_argument("origin_id", nargs="?")
+    parser.add_argument("destination_id", nargs="?")
+    parser.add_argument("--fare-matrix-path", default=FARE_MATRIX_PATH, help=f"folder of the fare matrix files (default {FARE_MATRIX_PATH})")
+    parser.add_argument("--serve", action="store_true", help="answer fare lookups over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    fare_table = FareTable(args.fare_matrix_path)
+
+    if args.serve:
+        serve(fare_table, args.host, args.port)
+    elif args.origin_id is None or args.destination_id is None:
+        parser.error("origin_id and destination_id are required unless --serve is given")
+    else:
+        try:
+            print(f"fare: {fare_table.fare(args.origin_id, args.destination_id)}, distance: {fare_table.distance(args.origin_id, args.destination_id):.0f} m")
+        except KeyError as error:
+            parser.error(error.args[0])
@@ -7,13 +7,15 @@ This file contain functions used for creating the GTFS data set apart from the f
 from collections import defaultdict
 
 import datetime as dt
+import hashlib
+import os
 import numpy as np
 import pandas as pd
-import haversine as hs
-import math
 
+from Geo import haversine_segments
 
-def create_stops_file(stops_data_path: str, GTFS_data_path: str):
+
+def create_stops_file(stop_registry, feed_writer):
     '''
     This function generates the "stops.csv" file for a GTFS dataset. Each stop on a metro line is assigned a unique identifier called "stop_id".
     The format of a stop_id consists of three parts: the mode of transport (here metro), the first letter of the line name, and a sequence number.
@@ -21,59 +23,29 @@ def create_stops_file(stops_data_path: str, GTFS_data_path: str):
     This ensures that each stop has a unique identifier within the dataset.
 
     Args:
-        stops_data_path (str): path of folder where all the metro line csv file is present, contaning stop_name, stop_latitude and stop_longitude.
-        GTFS_data_path (str): path of folder where all created GTFS files are stored.
+        stop_registry (StopRegistry): the stops of all metro lines, gotten from load_stop_registry function.
+        feed_writer (FeedWriter): writer of the GTFS files.
 
     Returns:
-        purple_line_df.shape[0] (int): number of stops in purple line.
-        green_line_df.shape[0] (int): number of stops in green line.
-        orange_line_df.shape[0] (int): number of stops in orange line.
-        yellow_line_df.shape[0] (int): number of stops in yellow line.
-        silver_line_df.shape[0] (int): number of stops in silver line.
-        red_line_df.shape[0] (int): number of stops in red line.
-        blue_line_df.shape[0] (int): number of stops in blue line.
-        pink_line_df.shape[0] (int): number of stops in pink line.
-
+        None
 
     '''
-    blue_line_df = pd.read_csv(f"{stops_data_path}/blue_line.csv")
-    green_line_df = pd.read_csv(f"{stops_data_path}/green_line.csv")
-    orange_line_df = pd.read_csv(f"{stops_data_path}/orange_line.csv")
-    pink_line_df = pd.read_csv(f"{stops_data_path}/pink_line.csv")
-    purple_line_df = pd.read_csv(f"{stops_data_path}/purple_line.csv")
-    red_line_df = pd.read_csv(f"{stops_data_path}/red_line.csv")
-    silver_line_df = pd.read_csv(f"{stops_data_path}/silver_line.csv")
-    yellow_line_df = pd.read_csv(f"{stops_data_path}/yellow_line.csv")
-
-    stops_txt = defaultdict(list)
-
-    stops_txt['stop_id'] = [f"M_P_{x+1}" for x in range(purple_line_df.shape[0])] + [f"M_G_{x+1}" for x in range(green_line_df.shape[0])] + [f"M_O_{x+1}" for x in range(orange_line_df.shape[0])] + [f"M_Y_{x+1}" for x in range(yellow_line_df.shape[0])] \
-                           + [f"M_S_{x+1}" for x in range(silver_line_df.shape[0])] + [f"M_R_{x+1}" for x in range(red_line_df.shape[0])] + [f"M_B_{x+1}" for x in range(blue_line_df.shape[0])] + [f"M_Pi_{x+1}" for x in range(pink_line_df.shape[0])]
-
-    stops_txt['stop_name'] = list(purple_line_df["stop_name"]) + list(green_line_df["stop_name"]) + list(orange_line_df["stop_name"]) + list(yellow_line_df["stop_name"]) + list(silver_line_df["stop_name"]) + list(red_line_df["stop_name"]) \
-                             + list(blue_line_df["stop_name"]) + list(pink_line_df["stop_name"])
-
-    stops_txt['stop_lat'] = list(purple_line_df["lat"]) + list(green_line_df["lat"]) + list(orange_line_df["lat"]) + list(yellow_line_df["lat"]) + list(silver_line_df["lat"]) + list(red_line_df["lat"]) \
-                             + list(blue_line_df["lat"]) + list(pink_line_df["lat"])
-
-    stops_txt['stop_lon'] = list(purple_line_df["lon"]) + list(green_line_df["lon"]) + list(orange_line_df["lon"]) + list(yellow_line_df["lon"]) + list(silver_line_df["lon"]) + list(red_line_df["lon"]) \
-                             + list(blue_line_df["lon"]) + list(pink_line_df["lon"])
 
-    stops_txt = pd.DataFrame.from_dict(stops_txt)
+    stops_txt = stop_registry.to_dataframe()
 
-    stops_txt.to_csv(f'{GTFS_data_path}/stops.csv', index=False)
+    feed_writer.write_table('stops.csv', [stops_txt])
 
-    return purple_line_df.shape[0], green_line_df.shape[0], orange_line_df.shape[0], yellow_line_df.shape[0], silver_line_df.shape[0], red_line_df.shape[0], blue_line_df.shape[0], pink_line_df.shape[0]
+    return
 
 
-def create_route_file(GTFS_data_path, route_id_list):
+def create_route_file(feed_writer, route_id_list):
     '''
     This function generates the "route.csv" file for a GTFS dataset. Each metro line in the dataset has two route identifiers that correspond to the two directions of travel along the line.
     The route_id is a combination of three parts: the mode of travel (here metro), the first letter of the line name, and the first letter of the first stop in one direction of the line.
     route_id = {mode of travel}_{first_letter_of_line_name}{first_letter_of_first_stop_in_one_direction}.
 
     Args:
-        GTFS_data_path (str): path of folder where all created GTFS files are stored.
+        feed_writer (FeedWriter): writer of the GTFS files.
         route_id_list (list): list of route_id for all 8 metro lines, resulting in 16 route_ids.
 
     Returns:
@@ -121,11 +93,63 @@ def create_route_file(GTFS_data_path, route_id_list):
 
     route_txt = pd.DataFrame.from_dict(routes_dict)
 
-    route_txt.to_csv(f'{GTFS_data_path}/route.csv', index=False)
+    feed_writer.write_table('route.csv', [route_txt])
 
     return
 
 
+_frequency_table_cache = {}
+
+
+def load_frequency_table(frequency_table_path: str, cache_folder_path=None):
+    '''
+        This function parses a frequency table workbook once per run, later calls for the same workbook return the already parsed table.
+        Parsing the workbook with openpyxl is the slowest read of the whole pipeline, so if cache_folder_path is given the parsed table is also pickled there,
+        named after the sha256 hash of the workbook, and later runs load the pickle instead of the workbook until the workbook changes.
+        The parsed table is kept in the cache, every call returns a copy of it so a caller modifying its table does not change the table of later calls.
+        A cached pickle which can not be read (e.g. half written, or written by another pandas version) is ignored and replaced by parsing the workbook again.
+
+        Args :
+            frequency_table_path (str): path of the frequency table workbook with start time, end time and frequency (in minutes) columns.
+            cache_folder_path (str): path of folder where the parsed tables are cached, None disables the cache.
+
+        Returns :
+            trips_frequency_table (pandas.DataFrame): containing frequency of metro line for different time slot of the day.
+
+    '''
+
+    with open(frequency_table_path, 'rb') as file:
+        frequency_table_digest = hashlib.sha256(file.read()).hexdigest()
+
+    if (frequency_table_path, frequency_table_digest) in _frequency_table_cache:
+        return _frequency_table_cache[(frequency_table_path, frequency_table_digest)].copy()
+
+    cache_file_path = None
+    if cache_folder_path is not None:
+        cache_file_path = f"{cache_folder_path}/{os.path.splitext(os.path.basename(frequency_table_path))[0]}.{frequency_table_digest[:16]}.pkl"
+
+    trips_frequency_table = None
+    if cache_file_path is not None and os.path.exists(cache_file_path):
+        try:
+            trips_frequency_table = pd.read_pickle(cache_file_path)
+        except Exception:
+            trips_frequency_table = None
+
+    if trips_frequency_table is None:
+        trips_frequency_table = pd.read_excel(frequency_table_path)[['start time', 'end time', 'frequency']]
+        trips_frequency_table['frequency'] = trips_frequency_table['frequency'].astype('float64')
+
+        if cache_file_path is not None:
+            # the pickle is written to a temporary file of this process and moved into place, so concurrent runs and interrupted writes never leave a half written pickle
+            os.makedirs(cache_folder_path, exist_ok=True)
+            trips_frequency_table.to_pickle(f'{cache_file_path}.{os.getpid()}.tmp')
+            os.replace(f'{cache_file_path}.{os.getpid()}.tmp', cache_file_path)
+
+    _frequency_table_cache[(frequency_table_path, frequency_table_digest)] = trips_frequency_table
+
+    return trips_frequency_table.copy()
+
+
 def create_trips_file(trips_frequency_table, route_id_str: str):
     '''
         This function is used to create the trips table which is later used as input for another function(create_stoptimes_file) and is also used to create trips.csv file for GTFS dataset.
@@ -142,8 +166,9 @@ def create_trips_file(trips_frequency_table, route_id_str: str):
 
     '''
 
-    # making necessary column additions to the trip frequeny DataFrame
+    # making necessary column additions to a copy of the trip frequeny DataFrame, the table from load_frequency_table is shared by every route
 
+    trips_frequency_table = trips_frequency_table.copy()
     trips_frequency_table['frequency'] = trips_frequency_table['frequency'].apply(lambda x: dt.timedelta(minutes=x))
     trips_frequency_table['end time'] = trips_frequency_table['end time'].apply(lambda x: dt.datetime.combine(dt.date.today(), x))
     trips_frequency_table['start time'] = trips_frequency_table['start time'].apply(lambda x: dt.datetime.combine(dt.date.today(), x))
@@ -177,53 +202,124 @@ def create_trips_file(trips_frequency_table, route_id_str: str):
     return trips_table
 
 
-def create_stoptimes_file(stop_times_txt, trips_table: pd.DataFrame, line_id_str: str,route_id: str, metro_line_time_difference_between_stops: list, start_point_of_trip_file: int, route_id_list: list):
+def create_frequencies_file(trips_frequency_table, route_id_str: str):
+    '''
+        This function is used to create the frequency based alternative to create_trips_file. Instead of one trip per train, every route gets a single template trip
+        whose stop times are repeated at the headway of each time slot, as described by the "frequencies.txt" file of the GTFS dataset.
+        exact_times is set to 1, so the trains start at the start of the time slot and then every headway_secs before the end of the time slot, which are exactly the trips create_trips_file generates.
+
+        Args :
+            trips_frequency_table (pandas.DataFrame): containing frequency of metro line for different time slot of the day.
+            route_id_str (str): Denotes the route_id of metro_line in a specific direction.
+
+        Returns :
+            trips_table (pandas.Dataframe): A DataFrame containing trip_id, route_id and arrival time of the template trip, which starts at the first time slot.
+            frequencies_table (pandas.Dataframe): A DataFrame containing trip_id, start_time, end_time, headway_secs and exact_times for every time slot.
+
+    '''
+
+    trip_id = f'{route_id_str}_1'
+
+    trips_table = pd.DataFrame({'trip_id': [trip_id],
+                                'route_id': [route_id_str],
+                                'arrival time': [dt.datetime.combine(dt.date.today(), trips_frequency_table['start time'].iloc[0])]})
+
+    frequencies_table = pd.DataFrame({'trip_id': trip_id,
+                                      'start_time': trips_frequency_table['start time'].apply(lambda x: x.strftime('%H:%M:%S')),
+                                      'end_time': trips_frequency_table['end time'].apply(lambda x: x.strftime('%H:%M:%S')),
+                                      'headway_secs': (trips_frequency_table['frequency'] * 60).round().astype('int64'),
+                                      'exact_times': 1})
+
+    return trips_table, frequencies_table
+
+
+def create_stoptimes_file(trips_table: pd.DataFrame, line_id_str: str, route_id: str, metro_line_time_difference_between_stops: list, start_point_of_trip_file: int, route_id_list: list):
     """
-        This Function is used to create the stopstimes.txt file
+        This Function is used to create the stop times of one route for the stopstimes.txt file.
+        The arrival time of every stop of every trip is found in one go by adding the start time of each trip to the cumulative time offset of each stop.
 
         Args :
             trips_table : DataFrame gotten from create_trips_file function
             line_id_str : String containing the metro line initial, used for naming purposes
+            route_id : route_id of the metro line in a specific direction
             metro_line_time_diiference_between_stops : A list constaining the time difference between consecutive stops
+            start_point_of_trip_file : row of trips_table from where the trips of this route start
+            route_id_list : list of route_id for all metro lines, every second route_id starting from the first one runs along the stop order of the line
 
         Returns :
-            stop_times_txt : A DataFrame which will be converted to stoptimes.txt file
+            stop_times_txt : A DataFrame with the stop times of this route, to be concatenated into the stoptimes.txt file
 
     """
 
-    # making necessary changes to the time difference list
-    metro_line_time_difference_between_stops.append(0)
-    metro_line_time_difference_between_stops = [dt.timedelta(minutes=val) for val in metro_line_time_difference_between_stops]
+    # cumulative time offset of every stop from the first stop of the trip
+    stop_offsets = np.concatenate(([0], np.cumsum(metro_line_time_difference_between_stops))).astype('timedelta64[m]')
 
-    # Filling the stop times dictionary with relevant data and converting it to DataFrame
+    route_trips_table = trips_table.iloc[start_point_of_trip_file:]
+    trip_start_times = pd.to_datetime(route_trips_table["arrival time"]).to_numpy()
 
-    for row in range(start_point_of_trip_file, trips_table.shape[0]):
+    # arrival time matrix of shape (number of trips, number of stops)
+    arrival_times = trip_start_times[:, np.newaxis] + stop_offsets[np.newaxis, :]
+    number_of_trips, number_of_stops = arrival_times.shape
 
-        arrival_time = trips_table["arrival time"].iloc[row]
+    if route_id in route_id_list[::2]:
+        stop_sequence = np.arange(1, number_of_stops + 1)
+    else:
+        stop_sequence = np.arange(number_of_stops, 0, -1)
+    stop_ids = np.char.add(f'{line_id_str}_', stop_sequence.astype(str))
 
-        for index in range(len(metro_line_time_difference_between_stops)):
+    stop_times_txt = pd.DataFrame({'trip_id': np.repeat(route_trips_table["trip_id"].to_numpy(), number_of_stops),
+                                   'arrival_time': arrival_times.ravel(),
+                                   'stop_id': np.tile(stop_ids, number_of_trips),
+                                   'sequence_id': np.tile(np.arange(number_of_stops), number_of_trips)})
 
-            stop_times_txt['trip_id'].append(trips_table["trip_id"].iloc[row])
-            stop_times_txt['arrival_time'].append(arrival_time)
-            arrival_time = arrival_time + metro_line_time_difference_between_stops[index]
-            if route_id in route_id_list[:len(route_id_list):2]:
-                stop_times_txt['stop_id'].append(f'{line_id_str}_{index + 1}')
-            else:
-                stop_times_txt['stop_id'].append(f'{line_id_str}_{len(metro_line_time_difference_between_stops) - (index)}')
-            stop_times_txt['sequence_id'].append(index)
+    return stop_times_txt
     # routes_dict['route_id'] = ['PW', 'PC', 'GM', 'GS', 'OJ', 'OK', 'YR', 'YB', 'SH', 'SK', 'RK', 'RS', 'BS', 'BK', 'PiK', 'PiN']
 
 
-def time_gap(stops_data_path, metro_name, metro_speed, reverse):
-    df = pd.read_csv(f"{stops_data_path}/{metro_name}.csv")
-    names = list(df["stop_name"])
-    lat = list(df['lat'])
-    lon = list(df['lon'])
-    dis = []
-    for i in range(1, len(names)):
-        dis.append(hs.haversine((lat[i-1], lon[i-1]), (lat[i], lon[i])))
+def create_route_schedule(stop_registry, route_id: str, route_id_list: list, trips_frequency_table, metro_speed, frequency_based=False):
+    '''
+        This function creates the trips and stop times of one route. It only depends on its arguments, so the routes can be created independently of each other,
+        one after another or in separate worker processes, and their tables concatenated in route order.
+
+        Args :
+            stop_registry (StopRegistry): the stops of all metro lines, gotten from load_stop_registry function.
+            route_id (str): route_id of the metro line in a specific direction.
+            route_id_list (list): list of route_id for all metro lines, every second route_id starting from the first one runs along the stop order of the line.
+            trips_frequency_table (pandas.DataFrame): containing frequency of metro line for different time slot of the day for the direction of this route.
+            metro_speed (float): speed of the metro in km/h.
+            frequency_based (bool): if True the route gets one template trip and its frequencies (create_frequencies_file) instead of every trip (create_trips_file).
+
+        Returns :
+            trips_table (pandas.Dataframe): A DataFrame containing trip_id, route_id and arrival time of the trips of this route.
+            stop_times_txt (pandas.Dataframe): A DataFrame with the stop times of this route.
+            frequencies_table (pandas.Dataframe): A DataFrame with the frequencies of this route, None if frequency_based is False.
+
+    '''
+
+    metro_line_id = route_id[:-1]
+    consecutive_station_time_difference = time_gap(stop_registry=stop_registry, metro_line_id=metro_line_id, metro_speed=metro_speed, reverse=0 if route_id in route_id_list[::2] else 1)
+
+    if frequency_based:
+        trips_table, frequencies_table = create_frequencies_file(trips_frequency_table, route_id)
+    else:
+        trips_table = create_trips_file(trips_frequency_table, route_id)
+        frequencies_table = None
+
+    stop_times_txt = create_stoptimes_file(trips_table=trips_table,
+                                           line_id_str=metro_line_id,
+                                           route_id=route_id,
+                                           metro_line_time_difference_between_stops=consecutive_station_time_difference,
+                                           start_point_of_trip_file=0,
+                                           route_id_list=route_id_list)
+
+    return trips_table, stop_times_txt, frequencies_table
+
+
+def time_gap(stop_registry, metro_line_id, metro_speed, reverse):
+    line_slice = stop_registry.line_slice(metro_line_id)
+    dis = haversine_segments(stop_registry.stop_lat[line_slice], stop_registry.stop_lon[line_slice]) / 1000
 
-    time_gap = [math.ceil((x/metro_speed)*60) for x in dis]
+    time_gap = np.ceil((dis/metro_speed)*60).astype('int64').tolist()
 
     if reverse:
         return time_gap
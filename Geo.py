@@ -0,0 +1,75 @@
+'''
+This file contain the vectorized haversine functions used for all distance calculations of the GTFS data set.
+They work on whole arrays of latitudes and longitudes (in decimal degrees) at once, instead of calling haversine once per pair of stops,
+and use the same average earth radius as the haversine package, so distances are in meters.
+'''
+
+
+
+import numpy as np
+
+
+AVERAGE_EARTH_RADIUS = 6371008.8 # meters
+
+
+def haversine_distance(lat1, lon1, lat2, lon2):
+    '''
+    This function calculates the great-circle distance between pairs of points, element by element.
+
+    Args:
+        lat1 (numpy.ndarray): latitude of the first point of each pair.
+        lon1 (numpy.ndarray): longitude of the first point of each pair.
+        lat2 (numpy.ndarray): latitude of the second point of each pair.
+        lon2 (numpy.ndarray): longitude of the second point of each pair.
+
+    Returns:
+        distance (numpy.ndarray): distance in meters between the points of each pair, the arrays are broadcast against each other.
+
+    '''
+
+    lat1 = np.radians(lat1)
+    lon1 = np.radians(lon1)
+    lat2 = np.radians(lat2)
+    lon2 = np.radians(lon2)
+
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+
+    return AVERAGE_EARTH_RADIUS * 2 * np.arcsin(np.sqrt(d))
+
+
+def haversine_segments(lat, lon):
+    '''
+    This function calculates the distance between consecutive points of a sequence, such as the stops of a metro line.
+
+    Args:
+        lat (numpy.ndarray): latitude of every point.
+        lon (numpy.ndarray): longitude of every point.
+
+    Returns:
+        distance (numpy.ndarray): distance in meters between point i and point i+1, one shorter than the input.
+
+    '''
+
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+
+    return haversine_distance(lat[:-1], lon[:-1], lat[1:], lon[1:])
+
+
+def haversine_matrix(lat, lon):
+    '''
+    This function calculates the distance between every pair of points.
+
+    Args:
+        lat (numpy.ndarray): latitude of every point.
+        lon (numpy.ndarray): longitude of every point.
+
+    Returns:
+        distance (numpy.ndarray): matrix of shape (number of points, number of points) with the distance in meters from point i to point j.
+
+    '''
+
+    lat = np.asarray(lat, dtype='float64')
+    lon = np.asarray(lon, dtype='float64')
+
+    return haversine_distance(lat[:, np.newaxis], lon[:, np.newaxis], lat[np.newaxis, :], lon[np.newaxis, :])
@@ -0,0 +1,107 @@
+'''
+This file contain functions used for rebuilding only those GTFS files whose inputs have changed since the last run.
+The manifest is a json file which records, for every stage of main, the content hash of each input file the stage reads, the parameters it was run with and the files it wrote.
+A stage is rebuilt when any of these differ from the current run or when one of its output files is missing.
+'''
+
+
+
+import hashlib
+import json
+import os
+
+
+def get_file_digests(input_paths: list, root_path: str = None):
+    '''
+    This function calculates the sha256 content hash of every input file of a stage.
+
+    Args:
+        input_paths (list): paths of the files read by the stage.
+        root_path (str): folder the paths are relative to, None for the working directory. The digests stay keyed by the given paths,
+                         so a manifest written in one checkout matches the same files in another.
+
+    Returns:
+        file_digests (dict): path of each input file mapped to its sha256 hex digest.
+
+    '''
+
+    file_digests = {}
+    for path in input_paths:
+        with open(path if root_path is None else os.path.join(root_path, path), 'rb') as file:
+            file_digests[path] = hashlib.sha256(file.read()).hexdigest()
+
+    return file_digests
+
+
+def load_manifest(manifest_path: str):
+    '''
+    This function reads the manifest written by the last run, an empty manifest is returned when there is none or it can not be read.
+
+    Args:
+        manifest_path (str): path of the manifest json file.
+
+    Returns:
+        manifest (dict): stage name mapped to the inputs, parameters and outputs recorded for it.
+
+    '''
+
+    if not os.path.exists(manifest_path):
+        return {}
+
+    try:
+        with open(manifest_path) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+
+def is_stage_stale(manifest: dict, stage: str, file_digests: dict, parameters: dict, output_paths: list):
+    '''
+    This function checks whether a stage has to be rebuilt.
+
+    Args:
+        manifest (dict): manifest of the last run.
+        stage (str): name of the stage.
+        file_digests (dict): content hashes of the current input files, gotten from get_file_digests function.
+        parameters (dict): json serializable parameters the stage is run with.
+        output_paths (list): paths of the files written by the stage.
+
+    Returns:
+        stale (bool): True if the inputs or parameters changed or an output file is missing.
+
+    '''
+
+    stage_record = manifest.get(stage)
+    if stage_record is None:
+        return True
+
+    if stage_record.get('inputs') != file_digests or stage_record.get('parameters') != json.loads(json.dumps(parameters)):
+        return True
+
+    return not all(os.path.exists(path) for path in output_paths)
+
+
+def update_manifest(manifest_path: str, manifest: dict, stage: str, file_digests: dict, parameters: dict, output_paths: list):
+    '''
+    This function records a rebuilt stage and writes the manifest, the file is replaced atomically so an interrupted run never leaves a half written manifest.
+
+    Args:
+        manifest_path (str): path of the manifest json file.
+        manifest (dict): manifest of the current run, updated in place.
+        stage (str): name of the stage.
+        file_digests (dict): content hashes of the input files the stage was built from.
+        parameters (dict): json serializable parameters the stage was run with.
+        output_paths (list): paths of the files written by the stage.
+
+    Returns:
+        None
+
+    '''
+
+    manifest[stage] = {'inputs': file_digests, 'parameters': parameters, 'outputs': output_paths}
+
+    with open(f'{manifest_path}.tmp', 'w') as file:
+        json.dump(manifest, file, indent=4, sort_keys=True)
+    os.replace(f'{manifest_path}.tmp', manifest_path)
+
+    return
@@ -0,0 +1,101 @@
+'''
+This file contain the builder of the metro network used for the fare calculations.
+The lines are taken from the stop registry, consecutive stops of a line are joined by an edge weighted by their haversine distance (in meters),
+and the interchanges between lines are read from a csv file and added as edges of zero weight.
+The network is stored as a compressed sparse row (CSR) adjacency matrix, so adding a line only needs its stops csv file and its interchange rows.
+'''
+
+
+
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import csr_array
+
+from Geo import haversine_segments
+
+
+class MetroNetwork:
+    '''
+    Metro network over the stops of some of the lines of a stop registry.
+
+    Attributes:
+        stop_ids (numpy.ndarray): stop_id of every node of the network, in stop registry order.
+        stop_index (dict): stop_id mapped to its node index.
+        adjacency (scipy.sparse.csr_array): symmetric adjacency matrix, entry (i, j) is the distance in meters of the edge between node i and node j,
+                                            interchange edges are stored as explicit zeros.
+        interchanges (numpy.ndarray): node indices of both stops of every interchange, of shape (number of interchanges, 2).
+
+    '''
+
+    def __init__(self, stop_ids, adjacency, interchanges):
+        self.stop_ids = stop_ids
+        self.stop_index = {stop_id: index for index, stop_id in enumerate(stop_ids)}
+        self.adjacency = adjacency
+        self.interchanges = interchanges
+
+    def __len__(self):
+        return self.stop_ids.shape[0]
+
+
+def load_interchanges(interchanges_path: str):
+    '''
+    This function reads the interchanges between metro lines.
+
+    Args:
+        interchanges_path (str): path of the csv file with the from_stop_id and to_stop_id of both stops of every interchange.
+
+    Returns:
+        interchange_df (pandas.DataFrame): containing from_stop_id and to_stop_id.
+
+    '''
+
+    return pd.read_csv(interchanges_path, dtype=str)
+
+
+def build_metro_network(stop_registry, interchange_df, line_ids=None):
+    '''
+    This function builds the metro network of the given lines in one pass.
+    Interchanges between a line of the network and a line outside of it are left out, but every interchange must refer to stops of the stop registry.
+
+    Args:
+        stop_registry (StopRegistry): the stops of all metro lines, gotten from load_stop_registry function.
+        interchange_df (pandas.DataFrame): interchanges gotten from load_interchanges function.
+        line_ids (list): line_id of the lines in the network, None for all lines of the stop registry.
+
+    Returns:
+        metro_network (MetroNetwork): the metro network.
+
+    Raises:
+        ValueError: if an interchange refers to a stop_id which is not in the stop registry.
+
+    '''
+
+    if line_ids is None:
+        line_ids = stop_registry.line_ids
+
+    unknown_stop_ids = sorted(set(interchange_df["from_stop_id"]).union(interchange_df["to_stop_id"]).difference(stop_registry.stop_ids))
+    if unknown_stop_ids:
+        raise ValueError(f"interchanges refer to stop_ids which are not in the stop registry: {', '.join(unknown_stop_ids)}")
+
+    line_positions = [np.arange(*stop_registry.line_offsets[line_id]) for line_id in line_ids]
+    registry_positions = np.concatenate(line_positions)
+    line_of_node = np.repeat(np.arange(len(line_ids)), [positions.shape[0] for positions in line_positions])
+    stop_ids = stop_registry.stop_ids[registry_positions]
+
+    # every pair of consecutive nodes on the same line is an edge
+    segment_distances = haversine_segments(stop_registry.stop_lat[registry_positions], stop_registry.stop_lon[registry_positions])
+    same_line = line_of_node[:-1] == line_of_node[1:]
+    line_edge_start = np.flatnonzero(same_line)
+
+    node_index = pd.Series(np.arange(stop_ids.shape[0]), index=stop_ids)
+    network_interchange_df = interchange_df[interchange_df["from_stop_id"].isin(node_index.index) & interchange_df["to_stop_id"].isin(node_index.index)]
+    interchanges = np.column_stack((node_index[network_interchange_df["from_stop_id"]].to_numpy(), node_index[network_interchange_df["to_stop_id"]].to_numpy())).astype('int64')
+
+    edge_from = np.concatenate((line_edge_start, interchanges[:, 0]))
+    edge_to = np.concatenate((line_edge_start + 1, interchanges[:, 1]))
+    edge_weight = np.concatenate((segment_distances[same_line], np.zeros(interchanges.shape[0])))
+
+    adjacency = csr_array((np.concatenate((edge_weight, edge_weight)), (np.concatenate((edge_from, edge_to)), np.concatenate((edge_to, edge_from)))), shape=(stop_ids.shape[0], stop_ids.shape[0]))
+
+    return MetroNetwork(stop_ids, adjacency, interchanges)
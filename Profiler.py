@@ -0,0 +1,236 @@
+'''
+This file contain the stage profiler of main.py. Every stage of a run, and the steps inside it such as parsing the frequency tables, creating the stop times of the routes
+or the Dijkstra distance matrix, is wrapped in a stage of the profiler, which records its time, the rows it wrote and its peak resident memory (RSS),
+and prints them as a summary table at the end of the run. Stages can be nested, the time of a stage without the time of its nested stages is its own time,
+and a stage entered again inside the same stage, e.g. once per route, adds to the same record.
+
+The profiler is switched on with modes, "timers" records the above, "cprofile" also saves a cProfile file of every top level stage and
+"tracemalloc" also records the peak memory allocated by python objects in every stage, which is more precise than RSS but makes the run a lot slower.
+'''
+
+
+
+import cProfile
+import os
+import sys
+import time
+import tracemalloc
+
+from contextlib import contextmanager
+
+# resource is not available on windows, where the peak memory is not recorded
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+PROFILE_MODES = ['timers', 'cprofile', 'tracemalloc']
+
+
+def parse_profile_modes(profile_modes):
+    '''
+    This function reads the profile modes of the "--profile" option or the GTFS_PROFILE environment variable.
+
+    Args:
+        profile_modes (str): comma separated profile modes, "1" for "timers", None, "" or "0" to switch the profiler off.
+
+    Returns:
+        profile_modes (list): the profile modes, always containing "timers" unless the profiler is off.
+
+    Raises:
+        ValueError: if a profile mode is not one of PROFILE_MODES.
+
+    '''
+
+    if profile_modes is None or profile_modes.strip() in ['', '0']:
+        return []
+
+    modes = {'timers' if mode.strip() == '1' else mode.strip() for mode in profile_modes.split(',')}
+    unknown_modes = sorted(modes.difference(PROFILE_MODES))
+    if unknown_modes:
+        raise ValueError(f"unknown profile modes {', '.join(unknown_modes)}, expected some of {', '.join(PROFILE_MODES)}")
+
+    return [mode for mode in PROFILE_MODES if mode in modes or mode == 'timers']
+
+
+def read_peak_rss():
+    # peak resident memory of the process in bytes, VmHWM can be reset on linux while ru_maxrss only ever grows (kilobytes on linux, bytes on macOS),
+    # 0 where neither is available
+    try:
+        with open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return 0
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def reset_peak_rss():
+    # resets VmHWM to the current RSS, which lets every stage have its own peak instead of the peak of the process so far
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        pass
+
+
+class StageRecord:
+    '''
+    Measurements of one stage.
+
+    Attributes:
+        name (str): name of the stage.
+        depth (int): number of stages the stage is nested in.
+        calls (int): number of times the stage was entered.
+        seconds (float): time from the start to the end of the stage, summed over its calls.
+        nested_seconds (float): time spent in the stages nested in it.
+        rows (int): rows written by the stage, None if it writes none.
+        peak_rss (int): peak resident memory of the process in bytes during the stage.
+        traced_peak (int): peak memory in bytes allocated by python objects during the stage, None unless tracemalloc is on.
+        profile_file_path (str): path of the cProfile file of the stage, None unless cprofile is on and the stage is top level.
+
+    '''
+
+    def __init__(self, name: str, depth: int):
+        self.name = name
+        self.depth = depth
+        self.calls = 0
+        self.seconds = 0.0
+        self.nested_seconds = 0.0
+        self.rows = None
+        self.peak_rss = 0
+        self.traced_peak = None
+        self.profile_file_path = None
+
+    @property
+    def own_seconds(self):
+        return self.seconds - self.nested_seconds
+
+    def add_rows(self, number_of_rows: int):
+        self.rows = (self.rows or 0) + number_of_rows
+
+
+class StageProfiler:
+    '''
+    Records the stages of a run, without modes every stage is a no-op so the profiler can always be passed to the stage functions.
+
+    Args:
+        profile_modes (list): the profile modes, gotten from parse_profile_modes function, empty to switch the profiler off.
+        profile_data_path (str): path of folder where the cProfile files are saved.
+
+    Attributes:
+        records (list): StageRecord of every stage, in the order the stages started.
+
+    '''
+
+    def __init__(self, profile_modes=(), profile_data_path: str = "."):
+        self.profile_modes = list(profile_modes)
+        self.profile_data_path = profile_data_path
+        self.records = []
+        self.running_records = []
+        # record of every stage by the record of the stage it is nested in (None at top level) and its name
+        self.record_index = {}
+        self.start_time = time.perf_counter()
+
+        if 'tracemalloc' in self.profile_modes and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @property
+    def enabled(self):
+        return bool(self.profile_modes)
+
+    def sample_memory(self):
+        # the peaks since the last sample belong to every running stage, after which the peaks are reset for the next sample
+        peak_rss = read_peak_rss()
+        traced_peak = tracemalloc.get_traced_memory()[1] if 'tracemalloc' in self.profile_modes else None
+        for record in self.running_records:
+            record.peak_rss = max(record.peak_rss, peak_rss)
+            if traced_peak is not None:
+                record.traced_peak = max(record.traced_peak or 0, traced_peak)
+
+        reset_peak_rss()
+        if traced_peak is not None:
+            tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str):
+        '''
+        Context manager measuring one stage, it gives the StageRecord of the stage, to which the stage adds the rows it wrote with add_rows.
+        '''
+
+        if not self.enabled:
+            yield StageRecord(name, len(self.running_records))
+            return
+
+        parent_record = self.running_records[-1] if self.running_records else None
+        record = self.record_index.get((id(parent_record), name))
+        if record is None:
+            record = StageRecord(name, len(self.running_records))
+            self.record_index[(id(parent_record), name)] = record
+            self.records.append(record)
+
+        self.sample_memory()
+        self.running_records.append(record)
+        record.calls += 1
+
+        profile = None
+        if 'cprofile' in self.profile_modes and record.depth == 0:
+            profile = cProfile.Profile()
+            profile.enable()
+
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            seconds = time.perf_counter() - start
+            record.seconds += seconds
+
+            if profile is not None:
+                profile.disable()
+                os.makedirs(self.profile_data_path, exist_ok=True)
+                record.profile_file_path = f"{self.profile_data_path}/{name}.prof"
+                profile.dump_stats(record.profile_file_path)
+
+            self.sample_memory()
+            self.running_records.pop()
+            if self.running_records:
+                self.running_records[-1].nested_seconds += seconds
+
+    def iterate(self, name: str, iterable):
+        '''
+        Yields every item of iterable, getting each item is measured as a call of the stage name, e.g. creating the routes consumed by a streamed table.
+        '''
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as record:
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    record.calls -= 1
+                    return
+            yield item
+
+    def summary(self):
+        '''
+        Returns the summary table of the recorded stages, nested stages are indented under their stage.
+        '''
+
+        traced = 'tracemalloc' in self.profile_modes
+        lines = [f"{'stage':<36}{'calls':>6}{'own s':>9}{'total s':>9}{'rows':>10}{'peak RSS MB':>13}" + (f"{'traced MB':>11}" if traced else "")]
+        for record in self.records:
+            line = f"{'  ' * record.depth + record.name:<36}{record.calls:>6}{record.own_seconds:>9.3f}{record.seconds:>9.3f}{'' if record.rows is None else record.rows:>10}{record.peak_rss / 2**20:>13.1f}"
+            if traced:
+                line += f"{record.traced_peak / 2**20:>11.1f}"
+            lines.append(line)
+
+        lines.append(f"{'total':<36}{'':>6}{'':>9}{time.perf_counter() - self.start_time:>9.3f}{'':>10}{max([record.peak_rss for record in self.records], default=read_peak_rss()) / 2**20:>13.1f}")
+        lines.extend(f"cProfile of {record.name} saved to {record.profile_file_path}" for record in self.records if record.profile_file_path is not None)
+
+        return '\n'.join(lines)
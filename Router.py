@@ -0,0 +1,321 @@
+'''
+This file contain the timetable query engine, which answers earliest arrival journeys over the trips and stop times written by main.py with the connection scan algorithm (CSA).
+Every pair of consecutive stop times of a trip is a connection, the connections are stored as arrays sorted by departure time, and a query scans them once from its departure time onwards.
+The interchanges of the metro network are zero cost transfers, all the stops joined by interchanges form one station and reaching any of them reaches all of them.
+Times are seconds since midnight of the service day.
+
+Usage:
+    python Router.py M_P_1 M_G_5 08:00:00                                       prints the earliest arrival at M_G_5 leaving M_P_1 at 08:00:00
+    python Router.py --matrix travel_times.npy --start 06:00:00 --end 22:00:00 --step 900 --workers 4
+                                                                                saves the travel time between every pair of stops for every departure time
+'''
+
+
+
+import argparse
+import bisect
+import re
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from scipy.sparse import coo_array
+from scipy.sparse.csgraph import connected_components
+
+
+UNREACHABLE = np.iinfo('int32').max
+
+
+def to_seconds(time):
+    '''
+    This function converts a time of the day, either seconds since midnight or a "HH:MM:SS" string (hours may be 24 or more), to seconds since midnight.
+    A string in any other format raises ValueError.
+    '''
+
+    if isinstance(time, str):
+        time_match = re.fullmatch(r'(\d+):([0-5]\d):([0-5]\d)', time.strip())
+        if time_match is None:
+            raise ValueError(f"time {time!r} is not in HH:MM:SS format")
+        hours, minutes, seconds = time_match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + int(seconds)
+
+    return int(time)
+
+
+def to_service_day_seconds(stop_times_df):
+    '''
+    This function converts the arrival_time and departure_time of stop times created by main.py, which are stamped with the service day, to seconds since midnight of the service day.
+    '''
+
+    service_day = stop_times_df['arrival_time'].min().normalize()
+
+    return stop_times_df.assign(**{column: ((stop_times_df[column] - service_day) // pd.Timedelta(seconds=1)).astype('int64') for column in ['arrival_time', 'departure_time']})
+
+
+def expand_frequencies(stop_times_df, frequencies_df):
+    '''
+    This function expands the template trips of a frequency based dataset into one trip per train, the same trips a default run of main.py writes.
+    With exact_times = 1 a train starts at start_time and then every headway_secs before end_time, and keeps the stop time offsets of its template trip.
+
+    Args:
+        stop_times_df (pandas.DataFrame): stop times of the template trips, with trip_id, stop_id, sequence_id, arrival_time and departure_time in seconds since midnight.
+        frequencies_df (pandas.DataFrame): containing trip_id, start_time, end_time and headway_secs, times in seconds since midnight.
+
+    Returns:
+        stop_times_df (pandas.DataFrame): stop times of every train, with the same columns.
+
+    '''
+
+    stop_times_df = stop_times_df.sort_values(['trip_id', 'sequence_id'], kind='stable')
+    template_start = stop_times_df.groupby('trip_id', sort=False)['departure_time'].transform('first')
+    offsets_df = stop_times_df.assign(arrival_offset=stop_times_df['arrival_time'] - template_start,
+                                      departure_offset=stop_times_df['departure_time'] - template_start)
+
+    number_of_starts = -((frequencies_df['start_time'] - frequencies_df['end_time']) // frequencies_df['headway_secs']).to_numpy()
+    slot_position = np.repeat(np.arange(frequencies_df.shape[0]), number_of_starts)
+    train_number = np.arange(slot_position.shape[0]) - np.repeat(np.cumsum(number_of_starts) - number_of_starts, number_of_starts)
+    trains_df = pd.DataFrame({'template_trip_id': frequencies_df['trip_id'].to_numpy()[slot_position],
+                              'trip_id': np.arange(slot_position.shape[0]),
+                              'start': frequencies_df['start_time'].to_numpy()[slot_position] + train_number * frequencies_df['headway_secs'].to_numpy()[slot_position]})
+
+    expanded_df = trains_df.merge(offsets_df.rename(columns={'trip_id': 'template_trip_id'}), on='template_trip_id')
+
+    return pd.DataFrame({'trip_id': expanded_df['trip_id'],
+                         'stop_id': expanded_df['stop_id'],
+                         'sequence_id': expanded_df['sequence_id'],
+                         'arrival_time': expanded_df['start'] + expanded_df['arrival_offset'],
+                         'departure_time': expanded_df['start'] + expanded_df['departure_offset']})
+
+
+class Timetable:
+    '''
+    Connections of every trip sorted by departure time, and the stations formed by the interchanges of the metro network.
+
+    Args:
+        stop_times_df (pandas.DataFrame): containing trip_id, stop_id, sequence_id, arrival_time and departure_time, times in seconds since midnight.
+        metro_network (MetroNetwork): network whose interchanges are the zero cost transfers, gotten from get_new_metro_network function of Fare.py.
+
+    Attributes:
+        stop_ids (numpy.ndarray): stop_id of every stop, in the order of the nodes of the metro network and of the query results.
+        stop_index (dict): stop_id mapped to its position in stop_ids.
+        station_of_stop (numpy.ndarray): station of every stop, the stops joined by interchanges share one station.
+        departure_times, arrival_times (numpy.ndarray): int32 departure time from the first stop and arrival time at the second stop of every connection, sorted by departure time.
+        departure_stations, arrival_stations (numpy.ndarray): station of the first and second stop of every connection.
+        connection_trips (numpy.ndarray): trip of every connection.
+
+    Raises:
+        ValueError: if a stop time refers to a stop_id which is not in the metro network.
+
+    '''
+
+    def __init__(self, stop_times_df, metro_network):
+        self.stop_ids = metro_network.stop_ids
+        self.stop_index = metro_network.stop_index
+
+        number_of_stops = len(metro_network)
+        interchanges = metro_network.interchanges
+        interchange_graph = coo_array((np.ones(interchanges.shape[0]), (interchanges[:, 0], interchanges[:, 1])), shape=(number_of_stops, number_of_stops))
+        self.number_of_stations, self.station_of_stop = connected_components(interchange_graph, directed=False)
+
+        unknown_stop_ids = sorted(set(stop_times_df['stop_id']).difference(self.stop_index))
+        if unknown_stop_ids:
+            raise ValueError(f"stop times refer to stop_ids which are not in the metro network: {', '.join(unknown_stop_ids)}")
+
+        stop_times_df = stop_times_df.sort_values(['trip_id', 'sequence_id'], kind='stable')
+        trips = pd.factorize(stop_times_df['trip_id'])[0]
+        stations = self.station_of_stop[stop_times_df['stop_id'].map(self.stop_index).to_numpy()]
+        arrival_times = stop_times_df['arrival_time'].to_numpy()
+        departure_times = stop_times_df['departure_time'].to_numpy()
+        self.number_of_trips = int(trips.max()) + 1 if trips.shape[0] else 0
+
+        # every stop time but the last of its trip departs on a connection to the next stop time
+        same_trip = trips[:-1] == trips[1:]
+        order = np.lexsort((arrival_times[1:][same_trip], departure_times[:-1][same_trip]))
+
+        self.departure_times = departure_times[:-1][same_trip][order].astype('int32')
+        self.arrival_times = arrival_times[1:][same_trip][order].astype('int32')
+        self.departure_stations = stations[:-1][same_trip][order].astype('int32')
+        self.arrival_stations = stations[1:][same_trip][order].astype('int32')
+        self.connection_trips = trips[:-1][same_trip][order].astype('int32')
+
+        # plain lists are scanned much faster than numpy arrays by a single query
+        self.connections = list(zip(self.departure_times.tolist(), self.arrival_times.tolist(), self.departure_stations.tolist(),
+                                    self.arrival_stations.tolist(), self.connection_trips.tolist()))
+        self.departure_time_list = self.departure_times.tolist()
+
+    def __len__(self):
+        return self.departure_times.shape[0]
+
+    def get_stations(self, stop_ids):
+        try:
+            return [int(self.station_of_stop[self.stop_index[stop_id]]) for stop_id in stop_ids]
+        except KeyError as error:
+            raise KeyError(f"unknown stop_id {error.args[0]}") from None
+
+    def scan(self, origin_station: int, departure_time: int, destination_station=None):
+        # connection scan from one station, stops early once no later connection can improve the arrival at destination_station
+        earliest_arrival = [UNREACHABLE] * self.number_of_stations
+        earliest_arrival[origin_station] = departure_time
+        boarded = bytearray(self.number_of_trips)
+
+        for connection_departure, connection_arrival, departure_station, arrival_station, trip in self.connections[bisect.bisect_left(self.departure_time_list, departure_time):]:
+            if destination_station is not None and connection_departure >= earliest_arrival[destination_station]:
+                break
+            if boarded[trip] or earliest_arrival[departure_station] <= connection_departure:
+                boarded[trip] = 1
+                if connection_arrival < earliest_arrival[arrival_station]:
+                    earliest_arrival[arrival_station] = connection_arrival
+
+        return earliest_arrival
+
+    def earliest_arrival(self, origin_id: str, destination_id: str, departure_time):
+        '''
+        Returns the earliest arrival time in seconds since midnight at destination_id leaving origin_id at departure_time, None if it can not be reached that day.
+        '''
+
+        origin_station, destination_station = self.get_stations([origin_id, destination_id])
+        arrival_time = self.scan(origin_station, to_seconds(departure_time), destination_station)[destination_station]
+
+        return None if arrival_time == UNREACHABLE else arrival_time
+
+    def one_to_all(self, origin_id: str, departure_time):
+        '''
+        Returns the earliest arrival time in seconds since midnight at every stop leaving origin_id at departure_time, in the order of stop_ids, numpy.inf for the stops which can not be reached that day.
+        '''
+
+        earliest_arrival = np.array(self.scan(self.get_stations([origin_id])[0], to_seconds(departure_time)), dtype='float64')
+        earliest_arrival[earliest_arrival == UNREACHABLE] = np.inf
+
+        return earliest_arrival[self.station_of_stop]
+
+    def scan_batch(self, origin_stations, departure_times):
+        # connection scan of many queries at once, every connection updates the arrival times of all queries with one array operation per column of queries
+        number_of_queries = origin_stations.shape[0]
+        earliest_arrival = np.full((self.number_of_stations, number_of_queries), UNREACHABLE, dtype='int32')
+        earliest_arrival[origin_stations, np.arange(number_of_queries)] = departure_times
+        boarded = np.zeros((self.number_of_trips, number_of_queries), dtype=bool)
+        reached = np.empty(number_of_queries, dtype=bool)
+
+        for connection_departure, connection_arrival, departure_station, arrival_station, trip in self.connections[bisect.bisect_left(self.departure_time_list, departure_times.min()):]:
+            trip_boarded = boarded[trip]
+            np.less_equal(earliest_arrival[departure_station], connection_departure, out=reached)
+            np.logical_or(trip_boarded, reached, out=trip_boarded)
+            arrival_row = earliest_arrival[arrival_station]
+            np.putmask(arrival_row, trip_boarded & (arrival_row > connection_arrival), connection_arrival)
+
+        return earliest_arrival
+
+    def travel_time_matrix(self, departure_times, origin_ids=None, workers=1, batch_size=2048):
+        '''
+        This function computes the travel time from every origin to every stop for every departure time, e.g. every 15 minutes of the day for an accessibility analysis.
+        The queries are scanned batch_size at a time, and running with workers > 1 scans the batches in that many worker processes.
+
+        Args:
+            departure_times (list): departure times, in seconds since midnight or as "HH:MM:SS" strings.
+            origin_ids (list): stop_id of every origin, None for every stop.
+            workers (int): number of worker processes.
+            batch_size (int): number of queries scanned together, a batch holds a bool per trip and query.
+
+        Returns:
+            travel_times (numpy.ndarray): float32 travel time in seconds of shape (number of departure times, number of origins, number of stops),
+                                          in the order of stop_ids for the stops, numpy.inf for the stops which can not be reached that day.
+
+        '''
+
+        departure_times = np.array([to_seconds(departure_time) for departure_time in departure_times], dtype='int32')
+        origin_stations = np.array(self.get_stations(self.stop_ids if origin_ids is None else origin_ids), dtype='int64')
+
+        # queries are ordered by departure time, so each batch starts its scan as late as possible
+        order = np.argsort(departure_times, kind='stable')
+        query_origins = np.tile(origin_stations, departure_times.shape[0])
+        query_departures = np.repeat(departure_times[order], origin_stations.shape[0])
+        batches = [(query_origins[start:start + batch_size], query_departures[start:start + batch_size]) for start in range(0, query_origins.shape[0], batch_size)]
+
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                earliest_arrivals = list(executor.map(self.scan_batch, *zip(*batches)))
+        else:
+            earliest_arrivals = [self.scan_batch(*batch) for batch in batches]
+
+        earliest_arrival = np.concatenate(earliest_arrivals, axis=1)[self.station_of_stop] if batches else np.empty((len(self.stop_ids), 0), dtype='int32')
+        travel_times = (earliest_arrival - query_departures).astype('float32')
+        travel_times[earliest_arrival == UNREACHABLE] = np.inf
+
+        travel_times = travel_times.T.reshape(departure_times.shape[0], origin_stations.shape[0], len(self.stop_ids))
+        travel_times[order] = travel_times.copy()
+
+        return travel_times
+
+
+def load_timetable(GTFS_data_path: str, metro_network):
+    '''
+    This function reads the stop times written by main.py into a Timetable, the template trips of a frequency based dataset are expanded to one trip per train.
+
+    Args:
+        GTFS_data_path (str): path of folder containing "stoptimes.csv" and, for a frequency based dataset, "frequencies.csv".
+        metro_network (MetroNetwork): network whose interchanges are the zero cost transfers, gotten from get_new_metro_network function of Fare.py.
+
+    Returns:
+        timetable (Timetable): the connections of every trip.
+
+    '''
+
+    stop_times_df = to_service_day_seconds(pd.read_csv(f"{GTFS_data_path}/stoptimes.csv", parse_dates=['arrival_time', 'departure_time']))
+
+    try:
+        frequencies_df = pd.read_csv(f"{GTFS_data_path}/frequencies.csv")
+    except FileNotFoundError:
+        frequencies_df = None
+
+    if frequencies_df is not None:
+        for column in ['start_time', 'end_time']:
+            frequencies_df[column] = (pd.to_timedelta(frequencies_df[column]) // pd.Timedelta(seconds=1)).astype('int64')
+        stop_times_df = expand_frequencies(stop_times_df, frequencies_df)
+
+    return Timetable(stop_times_df, metro_network)
+
+
+if __name__ == "__main__":
+    from Fare import get_new_metro_network
+    from Network import load_interchanges
+    from Stops import load_stop_registry
+    from main import GTFS_DATA_PATH, INTERCHANGES_PATH, METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT, STOPS_DATA_PATH
+
+    parser = argparse.ArgumentParser(description="Answer earliest arrival queries over the trips and stop times written by main.py.")
+    parser.add_argument("origin_id", nargs="?")
+    parser.add_argument("destination_id", nargs="?")
+    parser.add_argument("departure_time", nargs="?", help="HH:MM:SS")
+    parser.add_argument("--GTFS-data-path", default=GTFS_DATA_PATH, help=f"folder of the GTFS files (default {GTFS_DATA_PATH})")
+    parser.add_argument("--matrix", help="save the travel time matrix of every departure time from --start to --end into this .npy file")
+    parser.add_argument("--start", default="05:00:00")
+    parser.add_argument("--end", default="23:00:00")
+    parser.add_argument("--step", type=int, default=900, help="seconds between departure times of the travel time matrix")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    # the times are checked before the timetable is loaded, so a mistyped time fails at once
+    try:
+        for time in [args.start, args.end] + ([args.departure_time] if args.departure_time is not None else []):
+            to_seconds(time)
+    except ValueError as error:
+        parser.error(str(error))
+
+    stop_registry = load_stop_registry(STOPS_DATA_PATH, METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT)
+    timetable = load_timetable(args.GTFS_data_path, get_new_metro_network(stop_registry, load_interchanges(INTERCHANGES_PATH)))
+
+    if args.matrix is not None:
+        departure_times = range(to_seconds(args.start), to_seconds(args.end) + 1, args.step)
+        np.save(args.matrix, timetable.travel_time_matrix(departure_times, workers=args.workers))
+    elif args.departure_time is None:
+        parser.error("origin_id, destination_id and departure_time are required unless --matrix is given")
+    else:
+        try:
+            arrival_time = timetable.earliest_arrival(args.origin_id, args.destination_id, args.departure_time)
+        except KeyError as error:
+            parser.error(error.args[0])
+        if arrival_time is None:
+            print(f"{args.destination_id} can not be reached from {args.origin_id} after {args.departure_time}")
+        else:
+            print(f"arrival: {arrival_time // 3600:02d}:{arrival_time // 60 % 60:02d}:{arrival_time % 60:02d}, travel time: {(arrival_time - to_seconds(args.departure_time)) / 60:.1f} min")
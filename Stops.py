@@ -0,0 +1,93 @@
+'''
+This file contain the stop registry, an in-memory store of every stop of every metro line which is loaded once from the "stops_data" folder
+and then shared by the functions creating the stops, stop times and fare files, so that no line csv file is read more than once.
+'''
+
+
+
+import numpy as np
+import pandas as pd
+
+
+class StopRegistry:
+    '''
+    Columnar store of the stops of all metro lines, the stops of a line are stored one after the other in the order of the metro line map.
+    The stop_id of a stop is {line_id}_{sequence}, where line_id is the key of the line in the metro line map and sequence = 1,2,3,...number of stops in the line.
+
+    Attributes:
+        stop_ids (numpy.ndarray): stop_id of every stop.
+        stop_names (numpy.ndarray): stop_name of every stop.
+        stop_lat (numpy.ndarray): latitude of every stop.
+        stop_lon (numpy.ndarray): longitude of every stop.
+        line_ids (list): line_id of every metro line, in the order in which their stops are stored.
+        line_offsets (dict): line_id mapped to the (start, end) position of the stops of that line.
+
+    '''
+
+    def __init__(self, stop_ids, stop_names, stop_lat, stop_lon, line_offsets: dict):
+        self.stop_ids = stop_ids
+        self.stop_names = stop_names
+        self.stop_lat = stop_lat
+        self.stop_lon = stop_lon
+        self.line_ids = list(line_offsets)
+        self.line_offsets = line_offsets
+
+    def __len__(self):
+        return self.stop_ids.shape[0]
+
+    def line_slice(self, line_id: str):
+        '''
+        Returns the slice selecting the stops of one metro line from the stop arrays.
+        '''
+
+        start, end = self.line_offsets[line_id]
+
+        return slice(start, end)
+
+    def line_length(self, line_id: str):
+        '''
+        Returns the number of stops of one metro line.
+        '''
+
+        start, end = self.line_offsets[line_id]
+
+        return end - start
+
+    def to_dataframe(self):
+        '''
+        Returns the stops as a DataFrame with the stop_id, stop_name, stop_lat and stop_lon columns of the "stops.csv" file.
+        '''
+
+        return pd.DataFrame({'stop_id': self.stop_ids,
+                             'stop_name': self.stop_names,
+                             'stop_lat': self.stop_lat,
+                             'stop_lon': self.stop_lon})
+
+
+def load_stop_registry(stops_data_path: str, metro_line_map_to_metro_line_name_dict: dict):
+    '''
+    This function reads the csv file of every metro line once and stores all the stops in a StopRegistry.
+
+    Args:
+        stops_data_path (str): path of folder where all the metro line csv file is present, contaning stop_name, stop_latitude and stop_longitude.
+        metro_line_map_to_metro_line_name_dict (dict): line_id of every metro line mapped to the name of its csv file, in the order in which the stops are stored.
+
+    Returns:
+        stop_registry (StopRegistry): the stops of all metro lines.
+
+    '''
+
+    line_dfs = [pd.read_csv(f"{stops_data_path}/{metro_line_name}.csv") for metro_line_name in metro_line_map_to_metro_line_name_dict.values()]
+
+    line_offsets = {}
+    start = 0
+    for line_id, line_df in zip(metro_line_map_to_metro_line_name_dict, line_dfs):
+        line_offsets[line_id] = (start, start + line_df.shape[0])
+        start += line_df.shape[0]
+
+    stop_ids = np.array([f"{line_id}_{x+1}" for line_id, line_df in zip(metro_line_map_to_metro_line_name_dict, line_dfs) for x in range(line_df.shape[0])])
+    stop_names = np.concatenate([line_df["stop_name"].to_numpy(dtype=object) for line_df in line_dfs])
+    stop_lat = np.concatenate([line_df["lat"].to_numpy(dtype='float64') for line_df in line_dfs])
+    stop_lon = np.concatenate([line_df["lon"].to_numpy(dtype='float64') for line_df in line_dfs])
+
+    return StopRegistry(stop_ids, stop_names, stop_lat, stop_lon, line_offsets)
@@ -0,0 +1,263 @@
+'''
+This file contain the scenario sweep, which evaluates many what-if configurations of the schedule in one run, e.g. other metro speeds, other frequency tables,
+headways scaled up or down or only some of the metro lines. The inputs which do not depend on the schedule, the stop registry, the parsed frequency tables,
+the metro network and its distance matrix, are loaded once and shared by every scenario, and only the trips and stop times are created again for each scenario.
+
+For every scenario the sweep reports the trips, stop times, train-km and train-hours of its schedule, and the mean travel time and network speed between all pairs of stops
+at the peak departure times, found with the timetable router of Router.py. The stops, routes and fares are those of the full network written by main.py,
+so only the trips and stop times of a scenario are written when an output folder is given.
+
+Usage:
+    python Sweep.py --speeds 32 38 45                                   one scenario per metro speed
+    python Sweep.py --speeds 38 45 --headway-factors 0.5 1 --workers 4  every combination of metro speed and headway factor in 4 worker processes
+    python Sweep.py --scenarios scenarios.json --output-path ./GTFS_sweep
+                                                                        scenarios read from a json list of Scenario arguments, e.g. [{"name": "phase_1", "line_ids": ["M_P", "M_G"]}]
+'''
+
+
+
+import argparse
+import json
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from Fare import get_distance_matrix
+from Fare import get_new_metro_network
+from Geo import haversine_segments
+from GTFS import create_route_schedule
+from GTFS import load_frequency_table
+from Network import load_interchanges
+from Router import Timetable
+from Router import to_service_day_seconds
+from Stops import load_stop_registry
+from Writer import FeedWriter
+from main import FREQUENCY_TABLE_CACHE_PATH
+from main import FREQUENCY_TABLE_FRO_PATH
+from main import FREQUENCY_TABLE_TO_PATH
+from main import INTERCHANGES_PATH
+from main import METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT
+from main import METRO_SPEED
+from main import ROUTE_ID_LIST
+from main import STOPS_DATA_PATH
+
+
+SWEEP_DATA_PATH = "./GTFS_sweep"
+PEAK_DEPARTURE_TIMES = ['08:30:00', '18:00:00']
+
+
+class Scenario:
+    '''
+    One configuration of the schedule.
+
+    Args:
+        name (str): name of the scenario, also the name of its output folder.
+        metro_speed (float): speed of the metro in km/h.
+        frequency_table_to_path (str): path of the frequency table workbook of the routes along the stop order of their line.
+        frequency_table_fro_path (str): path of the frequency table workbook of the routes against the stop order of their line.
+        headway_factor (float): factor the headway of every time slot is multiplied by, 0.5 runs twice as many trains.
+        line_ids (list): line_id of the metro lines in service, None for all lines.
+
+    '''
+
+    def __init__(self, name: str, metro_speed: float = METRO_SPEED, frequency_table_to_path: str = FREQUENCY_TABLE_TO_PATH, frequency_table_fro_path: str = FREQUENCY_TABLE_FRO_PATH,
+                 headway_factor: float = 1.0, line_ids=None):
+        self.name = name
+        self.metro_speed = metro_speed
+        self.frequency_table_to_path = frequency_table_to_path
+        self.frequency_table_fro_path = frequency_table_fro_path
+        self.headway_factor = headway_factor
+        self.line_ids = line_ids
+
+
+class SweepInputs:
+    '''
+    Inputs shared by every scenario of a sweep.
+
+    Attributes:
+        stop_registry (StopRegistry): the stops of all metro lines.
+        metro_network (MetroNetwork): the network of all metro lines, whose interchanges are the transfers of the router.
+        distance_matrix (numpy.ndarray): network distance in meters between every pair of stops, in the order of the nodes of metro_network.
+        line_lengths (dict): line_id of every metro line mapped to its length in km.
+        frequency_tables (dict): path of every frequency table workbook used by a scenario mapped to the parsed table.
+
+    '''
+
+    def __init__(self, stop_registry, metro_network, distance_matrix, line_lengths: dict, frequency_tables: dict):
+        self.stop_registry = stop_registry
+        self.metro_network = metro_network
+        self.distance_matrix = distance_matrix
+        self.line_lengths = line_lengths
+        self.frequency_tables = frequency_tables
+
+
+def load_sweep_inputs(scenarios):
+    '''
+    This function loads the inputs shared by the scenarios, every frequency table workbook is parsed once however many scenarios use it.
+
+    Args:
+        scenarios (list): the Scenario of the sweep.
+
+    Returns:
+        sweep_inputs (SweepInputs): the shared inputs.
+
+    Raises:
+        ValueError: if two scenarios have the same name, a scenario has a metro_speed or headway_factor which is not positive or refers to an unknown line_id.
+
+    '''
+
+    scenario_names = [scenario.name for scenario in scenarios]
+    duplicate_names = sorted({name for name in scenario_names if scenario_names.count(name) > 1})
+    if duplicate_names:
+        raise ValueError(f"scenario names must be unique: {', '.join(duplicate_names)}")
+
+    # a speed or headway factor of zero or less gives no trains or infinite stop times, written as "not > 0" so nan is rejected too
+    for parameter in ['metro_speed', 'headway_factor']:
+        invalid_names = [scenario.name for scenario in scenarios if not getattr(scenario, parameter) > 0]
+        if invalid_names:
+            raise ValueError(f"{parameter} must be positive, scenarios: {', '.join(invalid_names)}")
+
+    stop_registry = load_stop_registry(STOPS_DATA_PATH, METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT)
+
+    unknown_line_ids = sorted({line_id for scenario in scenarios for line_id in (scenario.line_ids or [])}.difference(stop_registry.line_ids))
+    if unknown_line_ids:
+        raise ValueError(f"scenarios refer to line_ids which are not in the stop registry: {', '.join(unknown_line_ids)}")
+
+    metro_network = get_new_metro_network(stop_registry, load_interchanges(INTERCHANGES_PATH))
+    distance_matrix, stop_index = get_distance_matrix(metro_network)
+
+    line_lengths = {line_id: haversine_segments(stop_registry.stop_lat[stop_registry.line_slice(line_id)], stop_registry.stop_lon[stop_registry.line_slice(line_id)]).sum() / 1000
+                    for line_id in stop_registry.line_ids}
+
+    frequency_table_paths = sorted({path for scenario in scenarios for path in [scenario.frequency_table_to_path, scenario.frequency_table_fro_path]})
+    frequency_tables = {path: load_frequency_table(path, FREQUENCY_TABLE_CACHE_PATH) for path in frequency_table_paths}
+
+    return SweepInputs(stop_registry, metro_network, distance_matrix, line_lengths, frequency_tables)
+
+
+_sweep_inputs = None
+
+
+def set_sweep_inputs(sweep_inputs):
+    # the shared inputs are handed to every worker process once, instead of with every scenario
+    global _sweep_inputs
+    _sweep_inputs = sweep_inputs
+
+
+def run_scenario(scenario, output_path=None):
+    '''
+    This function creates the schedule of one scenario from the shared inputs set by set_sweep_inputs function and measures it.
+
+    Args:
+        scenario (Scenario): the scenario.
+        output_path (str): path of folder where the trips and stop times of the scenario are written into a folder named after it, None to only measure it.
+
+    Returns:
+        metrics (dict): containing the scenario parameters, the number of routes, trips and stop times, the train-km and train-hours,
+                        and the mean travel time in minutes, the mean network speed in km/h and the share of pairs of stops connected at the peak departure times.
+
+    '''
+
+    stop_registry = _sweep_inputs.stop_registry
+    line_ids = scenario.line_ids if scenario.line_ids is not None else stop_registry.line_ids
+    route_ids = [route_id for route_id in ROUTE_ID_LIST if route_id[:-1] in line_ids]
+
+    frequency_table_to = _sweep_inputs.frequency_tables[scenario.frequency_table_to_path]
+    frequency_table_fro = _sweep_inputs.frequency_tables[scenario.frequency_table_fro_path]
+    if scenario.headway_factor != 1:
+        frequency_table_to = frequency_table_to.assign(frequency=frequency_table_to['frequency'] * scenario.headway_factor)
+        frequency_table_fro = frequency_table_fro.assign(frequency=frequency_table_fro['frequency'] * scenario.headway_factor)
+
+    # the routes keep their direction from their position in ROUTE_ID_LIST, whichever lines are in service
+    route_schedules = [create_route_schedule(stop_registry, route_id, ROUTE_ID_LIST, frequency_table_to if route_id in ROUTE_ID_LIST[::2] else frequency_table_fro, scenario.metro_speed)
+                       for route_id in route_ids]
+    trips_df = pd.concat([route_trips_txt.drop(columns='arrival time') for route_trips_txt, route_stop_times_txt, route_frequencies_txt in route_schedules], ignore_index=True)
+    stop_times_df = pd.concat([route_stop_times_txt for route_trips_txt, route_stop_times_txt, route_frequencies_txt in route_schedules], ignore_index=True)
+    stop_times_df['departure_time'] = stop_times_df['arrival_time']
+
+    if output_path is not None:
+        os.makedirs(f"{output_path}/{scenario.name}", exist_ok=True)
+        with FeedWriter(f"{output_path}/{scenario.name}") as feed_writer:
+            feed_writer.write_table('trips.csv', [trips_df])
+            feed_writer.write_table('stoptimes.csv', [stop_times_df])
+
+    trip_times = stop_times_df.groupby('trip_id', sort=False)['arrival_time'].agg(['min', 'max'])
+    trips_per_route = trips_df['route_id'].value_counts()
+
+    # travel time between every pair of different stops, the pairs on lines out of service are never connected
+    timetable = Timetable(to_service_day_seconds(stop_times_df), _sweep_inputs.metro_network)
+    travel_times = timetable.travel_time_matrix(PEAK_DEPARTURE_TIMES).astype('float64')
+    connected = np.isfinite(travel_times) & ~np.eye(len(timetable.stop_ids), dtype=bool)[np.newaxis]
+    distances = np.broadcast_to(_sweep_inputs.distance_matrix, travel_times.shape)
+
+    return {'scenario': scenario.name,
+            'metro_speed': scenario.metro_speed,
+            'headway_factor': scenario.headway_factor,
+            'line_ids': ' '.join(line_ids),
+            'routes': len(route_ids),
+            'trips': trips_df.shape[0],
+            'stop_times': stop_times_df.shape[0],
+            'train_km': round(sum(trips_per_route.get(route_id, 0) * _sweep_inputs.line_lengths[route_id[:-1]] for route_id in route_ids), 1),
+            'train_hours': round((trip_times['max'] - trip_times['min']).sum() / pd.Timedelta(hours=1), 1),
+            'peak_mean_travel_time_min': round(travel_times[connected].mean() / 60, 2) if connected.any() else None,
+            'peak_mean_speed_kmh': round(distances[connected].sum() / travel_times[connected].sum() * 3.6, 2) if connected.any() else None,
+            'peak_connected_share': round(connected.sum() / (connected.shape[0] * (connected.shape[1] ** 2 - connected.shape[1])), 4)}
+
+
+def run_sweep(scenarios, output_path=None, workers=1):
+    '''
+    This function evaluates every scenario from inputs loaded once, running with workers > 1 evaluates the scenarios in that many worker processes.
+
+    Args:
+        scenarios (list): the Scenario of the sweep.
+        output_path (str): path of folder where the trips and stop times of every scenario and "summary.csv" are written, None to only return the summary.
+        workers (int): number of worker processes.
+
+    Returns:
+        summary (pandas.DataFrame): the metrics of every scenario (see run_scenario), one row per scenario in the order of scenarios.
+
+    '''
+
+    sweep_inputs = load_sweep_inputs(scenarios)
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=set_sweep_inputs, initargs=(sweep_inputs,)) as executor:
+            metrics = list(executor.map(run_scenario, scenarios, [output_path] * len(scenarios)))
+    else:
+        set_sweep_inputs(sweep_inputs)
+        metrics = [run_scenario(scenario, output_path) for scenario in scenarios]
+
+    summary = pd.DataFrame(metrics)
+
+    if output_path is not None:
+        summary.to_csv(f"{output_path}/summary.csv", index=False)
+
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate many schedule scenarios from inputs loaded once.")
+    parser.add_argument("--scenarios", help="json file with a list of Scenario arguments, e.g. [{\"name\": \"fast\", \"metro_speed\": 45}]")
+    parser.add_argument("--speeds", type=float, nargs="+", default=[METRO_SPEED], help=f"metro speeds in km/h (default {METRO_SPEED})")
+    parser.add_argument("--headway-factors", type=float, nargs="+", default=[1.0], help="factors the headways are multiplied by (default 1)")
+    parser.add_argument("--lines", nargs="+", default=None, help="line_id of the metro lines in service (default all)")
+    parser.add_argument("--output-path", nargs="?", const=SWEEP_DATA_PATH, default=None, help=f"write the trips and stop times of every scenario and summary.csv into this folder (default {SWEEP_DATA_PATH})")
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.scenarios is not None:
+        with open(args.scenarios) as file:
+            scenarios = [Scenario(**scenario_arguments) for scenario_arguments in json.load(file)]
+    else:
+        scenarios = [Scenario(f"speed_{metro_speed:g}_headway_x{headway_factor:g}", metro_speed, headway_factor=headway_factor, line_ids=args.lines)
+                     for metro_speed in args.speeds for headway_factor in args.headway_factors]
+
+    try:
+        summary = run_sweep(scenarios, args.output_path, args.workers)
+    except ValueError as error:
+        parser.error(str(error))
+
+    print(summary.to_string(index=False))
@@ -0,0 +1,196 @@
+'''
+This file contain the writer of the GTFS data set tables. A table is written one chunk (a DataFrame of some of its rows) at a time,
+so only the chunk being written has to be held in memory, either as csv files in the "GTFS_data" folder or as csv members of a zip file.
+Optionally every table is also written as a compact parquet file, which needs the pyarrow package.
+'''
+
+
+
+import io
+import os
+import time
+import zipfile
+
+
+class FeedWriter:
+    '''
+    Writes the tables of the GTFS dataset as csv files in a folder, or in a zip file if zip_path is given.
+    In a folder every table is first written to a temporary file which replaces the old table once complete, so an interrupted run never leaves a half written table.
+    A zip file can only be written one member at a time and is created anew, so it must receive every table of the dataset.
+    It is written to a temporary file which replaces the old zip file only when the writer is closed without an error, so a failed run keeps the old zip file.
+
+    Args:
+        GTFS_data_path (str): path of folder where all created GTFS files are stored.
+        zip_path (str): path of the zip file to write the tables into instead of the folder, None to write to the folder.
+        parquet_path (str): path of folder where a parquet copy of every table is written (see write_parquet_chunks), None to write csv only.
+
+    Attributes:
+        row_counts (dict): file_name of every table written mapped to its number of rows.
+
+    '''
+
+    def __init__(self, GTFS_data_path: str, zip_path=None, parquet_path=None):
+        self.GTFS_data_path = GTFS_data_path
+        self.zip_path = zip_path
+        self.parquet_path = parquet_path
+        self.row_counts = {}
+        self.zip_file = zipfile.ZipFile(f'{zip_path}.tmp', 'w', compression=zipfile.ZIP_DEFLATED) if zip_path is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(discard=exc_type is not None)
+
+    def close(self, discard=False):
+        # the zip file is only complete when every table was written, discard removes it instead of replacing the old zip file
+        if self.zip_file is not None:
+            self.zip_file.close()
+            self.zip_file = None
+            if discard:
+                os.remove(f'{self.zip_path}.tmp')
+            else:
+                os.replace(f'{self.zip_path}.tmp', self.zip_path)
+
+    def write_table(self, file_name: str, chunks):
+        '''
+        This function writes one table, the header is taken from the first chunk and every chunk is written as soon as it is produced.
+
+        Args:
+            file_name (str): name of the table file, e.g. "stoptimes.csv".
+            chunks (iterable): DataFrames with the rows of the table, all with the same columns, typically a generator.
+
+        Returns:
+            number_of_rows (int): number of rows written.
+
+        '''
+
+        if self.parquet_path is not None:
+            chunks = write_parquet_chunks(f'{self.parquet_path}/{os.path.splitext(file_name)[0]}.parquet', chunks)
+
+        if self.zip_file is not None:
+            zip_info = zipfile.ZipInfo(file_name, date_time=time.localtime()[:6])
+            zip_info.compress_type = zipfile.ZIP_DEFLATED
+            with self.zip_file.open(zip_info, 'w') as member:
+                with io.TextIOWrapper(member, encoding='utf-8', newline='') as file:
+                    number_of_rows = write_chunks(file, chunks)
+        else:
+            file_path = f'{self.GTFS_data_path}/{file_name}'
+            try:
+                with open(f'{file_path}.tmp', 'w', newline='') as file:
+                    number_of_rows = write_chunks(file, chunks)
+            except BaseException:
+                # an error while producing or writing the chunks leaves the old table as it was
+                os.remove(f'{file_path}.tmp')
+                raise
+            os.replace(f'{file_path}.tmp', file_path)
+
+        self.row_counts[file_name] = number_of_rows
+
+        return number_of_rows
+
+    def remove_table(self, file_name: str):
+        '''
+        This function removes a table left by an earlier run from the folder, a zip file never contains one as it is created anew.
+        '''
+
+        if self.zip_file is None and os.path.exists(f'{self.GTFS_data_path}/{file_name}'):
+            os.remove(f'{self.GTFS_data_path}/{file_name}')
+
+        if self.parquet_path is not None and os.path.exists(f'{self.parquet_path}/{os.path.splitext(file_name)[0]}.parquet'):
+            os.remove(f'{self.parquet_path}/{os.path.splitext(file_name)[0]}.parquet')
+
+
+def write_chunks(file, chunks):
+    number_of_rows = 0
+    for chunk_number, chunk in enumerate(chunks):
+        chunk.to_csv(file, header=(chunk_number == 0), index=False)
+        number_of_rows += chunk.shape[0]
+
+    return number_of_rows
+
+
+# integer type of the parquet columns which are not stored as they are in the csv files
+PARQUET_INTEGER_COLUMNS = {'sequence_id': 'int16',
+                           'fare': 'int16',
+                           'headway_secs': 'int32',
+                           'exact_times': 'int8',
+                           'route_desc': 'int8',
+                           'route_type': 'int8'}
+PARQUET_TIME_COLUMNS = ['arrival_time', 'departure_time', 'start_time', 'end_time']
+
+
+def to_parquet_columns(chunk):
+    '''
+    This function converts a chunk of a GTFS table to the compact column types of the parquet files.
+    Text id columns (stop_id, trip_id, route_id, origin_id, destination_id) are dictionary encoded, times are stored as int32 seconds since midnight of the service day
+    and small whole numbers such as fares as small integers. fare_id is unique for every row, so dictionary encoding it would not save anything.
+
+    Args:
+        chunk (pandas.DataFrame): rows of a GTFS table.
+
+    Returns:
+        chunk (pandas.DataFrame): the same rows with the parquet column types.
+
+    '''
+
+    import pandas as pd
+
+    chunk = chunk.copy()
+    for column in chunk.columns:
+        if column in PARQUET_TIME_COLUMNS:
+            if pd.api.types.is_datetime64_any_dtype(chunk[column]):
+                # the times of the dataset are stamped with the service day by create_trips_file
+                chunk[column] = ((chunk[column] - chunk[column].min().normalize()) // pd.Timedelta(seconds=1)).astype('int32')
+            else:
+                chunk[column] = (pd.to_timedelta(chunk[column]) // pd.Timedelta(seconds=1)).astype('int32')
+        elif column in PARQUET_INTEGER_COLUMNS:
+            chunk[column] = chunk[column].round().astype(PARQUET_INTEGER_COLUMNS[column])
+        elif column.endswith('_id') and column != 'fare_id':
+            chunk[column] = chunk[column].astype('category')
+
+    return chunk
+
+
+def write_parquet_chunks(parquet_file_path: str, chunks):
+    '''
+    This function writes every chunk of a table to a parquet file, each chunk as a row group, while passing the chunks on unchanged to the csv writer.
+    The parquet file replaces the old one only once the whole table is written.
+
+    Args:
+        parquet_file_path (str): path of the parquet file.
+        chunks (iterable): DataFrames with the rows of the table.
+
+    Yields:
+        chunk (pandas.DataFrame): every chunk of chunks.
+
+    '''
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(os.path.dirname(parquet_file_path) or '.', exist_ok=True)
+
+    parquet_writer = None
+    try:
+        for chunk in chunks:
+            parquet_table = pa.Table.from_pandas(to_parquet_columns(chunk), preserve_index=False)
+            for index, field in enumerate(parquet_table.schema):
+                if pa.types.is_dictionary(field.type):
+                    parquet_table = parquet_table.set_column(index, field.name, parquet_table.column(index).cast(pa.dictionary(pa.int32(), pa.string())))
+
+            if parquet_writer is None:
+                parquet_writer = pq.ParquetWriter(f'{parquet_file_path}.tmp', parquet_table.schema)
+            parquet_writer.write_table(parquet_table)
+
+            yield chunk
+    except BaseException:
+        # the table was not written completely, the old parquet file is kept
+        if parquet_writer is not None:
+            parquet_writer.close()
+            os.remove(f'{parquet_file_path}.tmp')
+        raise
+
+    if parquet_writer is not None:
+        parquet_writer.close()
+        os.replace(f'{parquet_file_path}.tmp', parquet_file_path)
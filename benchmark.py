@@ -0,0 +1,375 @@
+'''
+This file contain the benchmark suite of the GTFS generation pipeline. Every stage of main.py is timed on its own, on the real Bangalore data and on synthetic networks
+with more stops (the stops of every line are interpolated between the real ones) and denser headways (the frequency of every time slot divided by the same factor),
+to see which stage breaks first as the network grows. The csv files are written to a temporary folder and their writing is timed separately from the stages creating them.
+
+Every scenario runs in a fresh worker process, so its peak RSS is its own and a stage running out of memory only ends that scenario.
+The results of every run are appended as one json line to "benchmark_history.jsonl", with the git commit, time and python version,
+and every stage is compared with the same scenario of the previous run.
+
+Usage:
+    python benchmark.py                                     real data and synthetic networks at 2x, 10x and 50x the stop count and headway density
+    python benchmark.py --scales 2 10 --axes stops          synthetic networks with 2x and 10x the stop count only
+    python benchmark.py --memory-limit 4096                 stages needing more than 4096 MB fail with MemoryError instead of exhausting the machine
+'''
+
+
+
+import argparse
+import datetime as dt
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from importlib import metadata
+
+import numpy as np
+
+from main import FREQUENCY_TABLE_CACHE_PATH
+from main import FREQUENCY_TABLE_FRO_PATH
+from main import FREQUENCY_TABLE_TO_PATH
+from main import INTERCHANGES_PATH
+from main import METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT
+from main import METRO_SPEED
+from main import ROUTE_ID_LIST
+from main import SCRAPPED_FARE_PATH
+from main import STOPS_DATA_PATH
+from Profiler import read_peak_rss
+from Writer import FeedWriter
+
+
+BENCHMARK_HISTORY_PATH = "./benchmark_history.jsonl"
+SCALES = [2, 10, 50]
+REGRESSION_THRESHOLD = 1.5
+MINIMUM_COMPARED_SECONDS = 0.01 # shorter stages are too noisy to compare
+
+
+def scale_stop_registry(stop_registry, interchange_df, factor: int):
+    '''
+    This function creates a synthetic stop registry with factor times the stop count, factor - 1 stops are interpolated between every pair of consecutive stops of a line.
+    The real stops keep their stop_name, so the scrapped fares still apply, and the interchanges are moved to the new stop_id of their stops.
+
+    Args:
+        stop_registry (StopRegistry): the stops of all metro lines, gotten from load_stop_registry function.
+        interchange_df (pandas.DataFrame): interchanges gotten from load_interchanges function.
+        factor (int): number of segments every segment between two real stops is split into.
+
+    Returns:
+        stop_registry (StopRegistry): the synthetic stops.
+        interchange_df (pandas.DataFrame): the interchanges between the synthetic stops.
+
+    '''
+
+    from Stops import StopRegistry
+
+    stop_ids, stop_names, stop_lat, stop_lon = [], [], [], []
+    line_offsets = {}
+    start = 0
+    for line_id in stop_registry.line_ids:
+        line_slice = stop_registry.line_slice(line_id)
+        number_of_stops = stop_registry.line_length(line_id)
+
+        # position of every synthetic stop along the line, in units of real stops
+        position = np.arange((number_of_stops - 1) * factor + 1) / factor
+        real_stop = np.floor(position).astype('int64')
+
+        stop_ids.append(np.array([f"{line_id}_{sequence}" for sequence in range(1, position.shape[0] + 1)]))
+        stop_names.append(np.array([stop_name if step == 0 else f"{stop_name} {step}"
+                                    for stop_name, step in zip(stop_registry.stop_names[line_slice][real_stop], np.arange(position.shape[0]) % factor)], dtype=object))
+        stop_lat.append(np.interp(position, np.arange(number_of_stops), stop_registry.stop_lat[line_slice]))
+        stop_lon.append(np.interp(position, np.arange(number_of_stops), stop_registry.stop_lon[line_slice]))
+
+        line_offsets[line_id] = (start, start + position.shape[0])
+        start += position.shape[0]
+
+    def scale_stop_id(stop_id):
+        line_id, sequence = stop_id.rsplit('_', 1)
+        return f"{line_id}_{(int(sequence) - 1) * factor + 1}"
+
+    interchange_df = interchange_df.apply(lambda column: column.map(scale_stop_id))
+
+    return StopRegistry(np.concatenate(stop_ids), np.concatenate(stop_names), np.concatenate(stop_lat), np.concatenate(stop_lon), line_offsets), interchange_df
+
+
+def scale_frequency_table(trips_frequency_table, factor: int):
+    '''
+    This function creates a synthetic frequency table with factor times as many trains in every time slot.
+    '''
+
+    trips_frequency_table = trips_frequency_table.copy()
+    trips_frequency_table['frequency'] = trips_frequency_table['frequency'] / factor
+
+    return trips_frequency_table
+
+
+def set_memory_limit(memory_limit):
+    # address space limit of the worker process in MB, allocating past it raises MemoryError
+    if memory_limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit * 1024 * 1024, memory_limit * 1024 * 1024))
+
+
+def run_scenario(stop_factor: int, headway_factor: int):
+    '''
+    This function runs every stage of main.py once on the real data with the stop count scaled by stop_factor and the headway density by headway_factor.
+    A failing stage, e.g. with MemoryError, ends the schedule or fare stages it belongs to, and the other group still runs.
+
+    Args:
+        stop_factor (int): factor of the stop count, 1 for the real stops.
+        headway_factor (int): factor of the number of trains in every time slot, 1 for the real frequency tables.
+
+    Returns:
+        result (dict): containing the seconds spent in every stage, the number of rows of every file, the peak RSS in MB and the errors of the failed stages.
+
+    '''
+
+    import pandas as pd
+
+    from Fare import add_actual_distance_col
+    from Fare import add_haversine_distance_col
+    from Fare import create_fare_files
+    from Fare import get_distance_matrix
+    from Fare import get_new_metro_network
+    from Fare import get_old_metro_network
+    from Fare import linear_regression
+    from GTFS import create_stoptimes_file
+    from GTFS import create_stops_file
+    from GTFS import create_trips_file
+    from GTFS import load_frequency_table
+    from GTFS import time_gap
+    from Network import load_interchanges
+    from Stops import load_stop_registry
+
+    stages = {}
+    rows = {}
+    errors = []
+
+    def record_error(stage, error):
+        # an error raised while producing the chunks of a streamed table passes through write_csv too, it is recorded once for the stage it came from,
+        # and an error raised outside of any timed stage is recorded for the stage group it ended
+        if not hasattr(error, 'benchmark_stage'):
+            error.benchmark_stage = stage
+            errors.append({'stage': stage, 'error': f"{type(error).__name__}: {error}"})
+
+    def timed(stage, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        except Exception as error:
+            record_error(stage, error)
+            raise
+        finally:
+            stages[stage] = stages.get(stage, 0.0) + time.perf_counter() - start
+
+    def write_table(feed_writer, file_name, chunks):
+        # the stages producing the chunks of a streamed table are timed by themselves, the rest of write_table is csv writing
+        stage_seconds = sum(stages.values())
+        start = time.perf_counter()
+        rows[file_name] = timed('write_csv', feed_writer.write_table, file_name, chunks)
+        stages['write_csv'] -= sum(stages.values()) - stage_seconds - (time.perf_counter() - start)
+
+    with tempfile.TemporaryDirectory() as output_path, FeedWriter(output_path) as feed_writer:
+        stop_registry = timed('load_stop_registry', load_stop_registry, STOPS_DATA_PATH, METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT)
+        interchange_df = load_interchanges(INTERCHANGES_PATH)
+        if stop_factor > 1:
+            stop_registry, interchange_df = timed('scale_stop_registry', scale_stop_registry, stop_registry, interchange_df, stop_factor)
+
+        timed('create_stops_file', create_stops_file, stop_registry, feed_writer)
+        rows['stops.csv'] = len(stop_registry)
+
+        # CREATING TRIPS AND STOP TIMES FILES
+        try:
+            frequency_table_to, frequency_table_fro = [scale_frequency_table(timed('load_frequency_table', load_frequency_table, frequency_table_path, FREQUENCY_TABLE_CACHE_PATH), headway_factor)
+                                                       for frequency_table_path in [FREQUENCY_TABLE_TO_PATH, FREQUENCY_TABLE_FRO_PATH]]
+            trips_chunks = []
+
+            def stop_times_chunks():
+                for route_id in ROUTE_ID_LIST:
+                    forward = route_id in ROUTE_ID_LIST[::2]
+                    trips_table = timed('create_trips_file', create_trips_file, frequency_table_to if forward else frequency_table_fro, route_id)
+                    trips_chunks.append(trips_table.drop(columns='arrival time'))
+
+                    gaps = timed('create_stoptimes_file', time_gap, stop_registry, route_id[:-1], METRO_SPEED, 0 if forward else 1)
+                    stop_times_txt = timed('create_stoptimes_file', create_stoptimes_file, trips_table, route_id[:-1], route_id, gaps, 0, ROUTE_ID_LIST)
+                    stop_times_txt['departure_time'] = stop_times_txt['arrival_time']
+                    yield stop_times_txt
+
+            write_table(feed_writer, 'stoptimes.csv', stop_times_chunks())
+            write_table(feed_writer, 'trips.csv', trips_chunks)
+        except Exception as error:
+            record_error('schedule', error)
+
+        # CREATING FARE FILES
+        try:
+            scrapped_fare_df = pd.read_csv(SCRAPPED_FARE_PATH)
+            scrapped_fare_df, stop_dict = timed('add_haversine_distance_col', add_haversine_distance_col, scrapped_fare_df, stop_registry)
+            old_metro_network = timed('build_metro_network', get_old_metro_network, stop_registry, interchange_df)
+            old_distance_matrix, old_stop_index = timed('get_distance_matrix', get_distance_matrix, old_metro_network)
+            scrapped_fare_df = timed('add_actual_distance_col', add_actual_distance_col, scrapped_fare_df, stop_dict, old_distance_matrix, old_stop_index)
+            slope, intercept = timed('linear_regression', linear_regression, scrapped_fare_df)
+
+            new_metro_network = timed('build_metro_network', get_new_metro_network, stop_registry, interchange_df)
+            new_distance_matrix, new_stop_index = timed('get_distance_matrix', get_distance_matrix, new_metro_network)
+            del old_distance_matrix
+
+            fare_rule_df, fare_attribute_df = timed('create_fare_files', create_fare_files, stop_registry, scrapped_fare_df, new_distance_matrix, new_stop_index, slope, intercept)
+            del new_distance_matrix
+
+            write_table(feed_writer, 'fare_rule.csv', [fare_rule_df])
+            write_table(feed_writer, 'fare_attribute.csv', [fare_attribute_df])
+        except Exception as error:
+            record_error('fare', error)
+
+    return {'stages': stages,
+            'rows': rows,
+            'peak_rss_mb': read_peak_rss() / 2**20,
+            'errors': errors}
+
+
+def get_git_commit():
+    # commit of the benchmarked code, marked dirty if the working tree has changes, None outside of a git repository
+    try:
+        repository_path = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repository_path, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repository_path, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    return f"{commit}-dirty" if dirty else commit
+
+
+def get_package_version(package_name):
+    try:
+        return metadata.version(package_name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def load_history(benchmark_history_path: str):
+    if not os.path.exists(benchmark_history_path):
+        return []
+
+    with open(benchmark_history_path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def get_scenarios(scales, axes):
+    # (name, stop_factor, headway_factor) of every scenario, the real data first
+    scenarios = [('real', 1, 1)]
+    for scale in scales:
+        stop_factor = scale if axes in ['both', 'stops'] else 1
+        headway_factor = scale if axes in ['both', 'headway'] else 1
+        scenarios.append((f"stops_x{stop_factor}_headway_x{headway_factor}", stop_factor, headway_factor))
+
+    return scenarios
+
+
+def run_benchmark(scales=SCALES, axes='both', memory_limit=None, benchmark_history_path=BENCHMARK_HISTORY_PATH):
+    '''
+    This function runs every scenario in its own worker process and appends the results to the benchmark history.
+
+    Args:
+        scales (list): factors of the synthetic networks.
+        axes (str): 'both' to scale the stop count and the headway density together, 'stops' or 'headway' to scale only one of them.
+        memory_limit (int): address space limit of every scenario in MB, None for no limit.
+        benchmark_history_path (str): path of the json lines file the results are appended to.
+
+    Returns:
+        entry (dict): the results of this run, as appended to the benchmark history.
+
+    '''
+
+    entry = {'timestamp': dt.datetime.now(dt.timezone.utc).isoformat(timespec='seconds'),
+             'git_commit': get_git_commit(),
+             'python_version': platform.python_version(),
+             'platform': platform.platform(),
+             'package_versions': {package_name: get_package_version(package_name) for package_name in ['numpy', 'pandas', 'scipy']},
+             'cpu_count': os.cpu_count(),
+             'memory_limit_mb': memory_limit,
+             'scenarios': []}
+
+    for name, stop_factor, headway_factor in get_scenarios(scales, axes):
+        scenario = {'name': name, 'stop_factor': stop_factor, 'headway_factor': headway_factor}
+        start = time.perf_counter()
+        # a fresh spawned process per scenario, so the peak RSS is not inherited and a worker killed by the operating system only loses its own scenario
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'), initializer=set_memory_limit, initargs=(memory_limit,)) as executor:
+                scenario.update(executor.submit(run_scenario, stop_factor, headway_factor).result())
+        except BrokenProcessPool as error:
+            scenario.update({'stages': {}, 'rows': {}, 'peak_rss_mb': None, 'errors': [{'stage': None, 'error': f"{type(error).__name__}: {error}"}]})
+        except Exception as error:
+            # an error before the schedule and fare stages, e.g. reading the stops, ends the scenario, the stage it came from is kept by the pickled error
+            scenario.update({'stages': {}, 'rows': {}, 'peak_rss_mb': None, 'errors': [{'stage': getattr(error, 'benchmark_stage', None), 'error': f"{type(error).__name__}: {error}"}]})
+        scenario['total_seconds'] = time.perf_counter() - start
+        entry['scenarios'].append(scenario)
+        print(f"{name}: {scenario['total_seconds']:.1f} s" + (f", failed in {', '.join(str(error['stage']) for error in scenario['errors'])}" if scenario['errors'] else ''), flush=True)
+
+    with open(benchmark_history_path, 'a') as file:
+        file.write(json.dumps(entry) + '\n')
+
+    return entry
+
+
+def compare_with_history(entry, history, threshold=REGRESSION_THRESHOLD):
+    '''
+    This function prints the seconds of every stage of every scenario next to the same stage of the latest earlier run with that scenario.
+
+    Args:
+        entry (dict): the results of this run, gotten from run_benchmark function.
+        history (list): the earlier runs of the benchmark history.
+        threshold (float): a stage taking more than threshold times as long as before is reported as a regression.
+
+    Returns:
+        regressions (list): "scenario stage" of every regression.
+
+    '''
+
+    regressions = []
+    for scenario in entry['scenarios']:
+        previous_stages = next((previous_scenario['stages'] for previous_entry in reversed(history) for previous_scenario in previous_entry['scenarios']
+                                if previous_scenario['name'] == scenario['name'] and not previous_scenario['errors']), {})
+
+        peak_rss = f"{scenario['peak_rss_mb']:.0f} MB" if scenario['peak_rss_mb'] is not None else "unknown"
+        print(f"\n{scenario['name']} ({scenario['rows'].get('stops.csv', '?')} stops, {scenario['rows'].get('stoptimes.csv', '?')} stop times, "
+              f"{scenario['rows'].get('fare_rule.csv', '?')} fares, peak RSS {peak_rss})")
+        print(f"  {'stage':<28}{'seconds':>10}{'previous':>10}{'ratio':>8}")
+        for stage, seconds in scenario['stages'].items():
+            previous_seconds = previous_stages.get(stage)
+            if previous_seconds is None or previous_seconds < MINIMUM_COMPARED_SECONDS:
+                print(f"  {stage:<28}{seconds:>10.3f}")
+                continue
+
+            ratio = seconds / previous_seconds
+            regression = ratio > threshold
+            if regression:
+                regressions.append(f"{scenario['name']} {stage}")
+            print(f"  {stage:<28}{seconds:>10.3f}{previous_seconds:>10.3f}{ratio:>8.2f}" + ("  REGRESSION" if regression else ""))
+
+        for error in scenario['errors']:
+            print(f"  failed in {error['stage']}: {error['error']}")
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time every stage of the GTFS generation on the real data and on larger synthetic networks.")
+    parser.add_argument("--scales", type=int, nargs="*", default=SCALES, help=f"factors of the synthetic networks (default {' '.join(map(str, SCALES))}), none to run the real data only")
+    parser.add_argument("--axes", choices=['both', 'stops', 'headway'], default='both', help="scale the stop count and headway density together (default) or only one of them")
+    parser.add_argument("--memory-limit", type=int, default=None, help="address space limit of every scenario in MB")
+    parser.add_argument("--history", default=BENCHMARK_HISTORY_PATH, help=f"json lines file the results are appended to (default {BENCHMARK_HISTORY_PATH})")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD, help=f"slowdown of a stage reported as a regression (default {REGRESSION_THRESHOLD})")
+    args = parser.parse_args()
+
+    history = load_history(args.history)
+    entry = run_benchmark(args.scales, args.axes, args.memory_limit, args.history)
+    regressions = compare_with_history(entry, history, args.threshold)
+
+    if regressions:
+        print(f"\n{len(regressions)} regressions: {', '.join(regressions)}")
+        raise SystemExit(1)
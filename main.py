@@ -8,108 +8,325 @@ The fare for the upcoming metro lines is calculated using linear regression betw
 haversine distance between source and destination stops, where speed of the metro is assumed to be 38 km/hr.
 
 All the files required for the GTFS dataset, including "stops.csv", "route.csv", "trips.csv", "stoptimes.csv", "fare_rule.csv", and "fare_attribute.csv", are stored in the "GTFS_data" folder.
+
+The files are generated by stages which can also be run one at a time with a subcommand, and a stage only imports the modules it needs:
+    python main.py stops        "stops.csv"
+    python main.py routes       "route.csv"
+    python main.py schedule     "trips.csv" and "stoptimes.csv" (and "frequencies.csv")
+    python main.py fares        "fare_rule.csv", "fare_attribute.csv" and the fare matrices
+    python main.py all          every file, also what "python main.py" without a subcommand runs
+
+Running with "--frequencies" writes a frequency based dataset instead, with one template trip per route in "trips.csv" and "stoptimes.csv" and the headway of each time slot in "frequencies.csv".
+This dataset is much smaller, while the default mode writes every trip with exact stop times for consumers that need them.
+
+Every stage records the content hash of its inputs in "GTFS_manifest.json" next to the "GTFS_data" folder, and a later run only rebuilds the stages whose inputs changed.
+Running with "--force" rebuilds every file.
+The trips and stop times of the routes are independent of each other, running with "--workers N" creates them in N worker processes.
+The stop times and fare files are written a route or a block of origins at a time, and running with "--zip gtfs.zip" writes all the files into a zip file instead of the "GTFS_data" folder.
+Running with "--parquet" also writes every file as a parquet file into the "GTFS_parquet" folder, with dictionary encoded ids, times in seconds since midnight and fares as small integers, which needs pyarrow.
+The fare stage also saves the fare and distance between every pair of stops as ".npy" matrices in the "fare_matrix" folder, which FareService.py looks fares up in.
+Router.py answers earliest arrival journeys and travel time matrices over the generated trips and stop times.
+benchmark.py times every stage on the real data and on larger synthetic networks and keeps a history of the results.
+Sweep.py evaluates many metro speeds, frequency tables, headways or line subsets in one run, creating only the trips and stop times again for each of them.
+Running with "--profile" (or with the GTFS_PROFILE environment variable set to 1) prints the time, rows written and peak memory of every stage and of the steps inside it at the end of the run,
+"--profile cprofile,tracemalloc" also saves a cProfile file of every stage into the "GTFS_profile" folder and records the peak memory allocated by python objects.
 '''
 
-from collections import defaultdict
+import argparse
+import os
+
+from Manifest import get_file_digests
+from Manifest import load_manifest
+from Manifest import is_stage_stale
+from Manifest import update_manifest
+
+from Profiler import StageProfiler
+from Profiler import parse_profile_modes
+
+from Writer import FeedWriter
+
+# GTFS, Fare and Stops pull in pandas, numpy and scipy, so they are imported inside the stages that use them and a run with nothing to rebuild skips that cost
+
+
+METRO_SPEED = 38 # km/h
+ROUTE_ID_LIST = ['M_PW', 'M_PC', 'M_GM', 'M_GS', 'M_OJ', 'M_OK', 'M_YR', 'M_YB', 'M_SH', 'M_SK', 'M_RK', 'M_RS', 'M_BS', 'M_BK', 'M_PiK', 'M_PiN']
+METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT = {'M_P': "purple_line",
+                                          'M_G': "green_line",
+                                          'M_O': "orange_line",
+                                          'M_Y': "yellow_line",
+                                          'M_S': "silver_line",
+                                          'M_R': "red_line",
+                                          'M_B': "blue_line",
+                                          'M_Pi': "pink_line"}
+STOPS_DATA_PATH = f"./stops_data"
+GTFS_DATA_PATH = f"./GTFS_data"
+PARQUET_DATA_PATH = f"./GTFS_parquet"
+FARE_MATRIX_PATH = f"./fare_matrix"
+PROFILE_DATA_PATH = f"./GTFS_profile"
+
+FREQUENCY_TABLE_TO_PATH = './frequency_tables/trips time and frequency to.xlsx'
+FREQUENCY_TABLE_FRO_PATH = './frequency_tables/trips time and frequency fro.xlsx'
+FREQUENCY_TABLE_CACHE_PATH = './frequency_tables/.cache'
+SCRAPPED_FARE_PATH = "fare_scrapped.csv"
+INTERCHANGES_PATH = f"{STOPS_DATA_PATH}/interchanges.csv"
+
+MANIFEST_PATH = "./GTFS_manifest.json"
+STOPS_DATA_FILES = [f"{STOPS_DATA_PATH}/{metro_line_name}.csv" for metro_line_name in METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT.values()]
+# the source files are keyed by their path in the repository, so the manifest of one checkout matches the same sources in another
+SOURCE_PATH = os.path.dirname(os.path.abspath(__file__))
+MAIN_SOURCE_FILE = "main.py"
+WRITER_SOURCE_FILE = "Writer.py"
+GTFS_SOURCE_FILE = "GTFS.py"
+FARE_SOURCE_FILE = "Fare.py"
+STOPS_SOURCE_FILE = "Stops.py"
+NETWORK_SOURCE_FILE = "Network.py"
+GEO_SOURCE_FILE = "Geo.py"
+
+STAGE_NAMES = ['stops', 'route', 'schedule', 'fare']
+# stages run by every subcommand of the command line
+COMMAND_STAGE_NAMES = {'stops': ['stops'],
+                       'routes': ['route'],
+                       'schedule': ['schedule'],
+                       'fares': ['fare'],
+                       'all': STAGE_NAMES}
+
+
+
+
+def main(frequency_based=False, force=False, workers=1, gtfs_zip_path=None, parquet_path=None, profile_modes=(), stage_names=STAGE_NAMES):
+    # a zip file is created anew, so it has to receive the tables of every stage
+    if gtfs_zip_path is not None and set(stage_names) != set(STAGE_NAMES):
+        raise ValueError("a zip file can only be written by running every stage")
+
+    # every stage is measured by the profiler, which does nothing unless profile modes are given
+    profiler = StageProfiler(profile_modes, PROFILE_DATA_PATH)
+    stops_stale = route_stale = schedule_stale = fare_stale = False
 
-from GTFS import create_stops_file
-from GTFS import create_route_file
-from GTFS import create_trips_file
-from GTFS import create_stoptimes_file
-from GTFS import time_gap
+    with profiler.stage('manifest'):
+        # a zip file is always written with every table, so it bypasses the manifest of the GTFS_data folder
+        # a forced run still loads the manifest, so the stages it does not run keep their records
+        manifest = {} if gtfs_zip_path is not None else load_manifest(MANIFEST_PATH)
 
-from Fare import add_actual_distance_col
-from Fare import add_haversine_distance_col
-from Fare import get_old_metro_network
-from Fare import linear_regression
-from Fare import get_new_metro_network
-from Fare import create_fare_files
+        if 'stops' in stage_names:
+            stops_inputs = get_stage_digests(STOPS_DATA_FILES, [STOPS_SOURCE_FILE, GTFS_SOURCE_FILE])
+            stops_parameters = {'metro_lines': METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT, 'parquet_path': parquet_path}
+            stops_outputs = get_output_paths(['stops'], parquet_path)
+            stops_stale = force or is_stage_stale(manifest, 'stops', stops_inputs, stops_parameters, stops_outputs)
 
-import pandas as pd
+        if 'route' in stage_names:
+            route_inputs = get_stage_digests([], [GTFS_SOURCE_FILE])
+            route_parameters = {'route_ids': ROUTE_ID_LIST, 'parquet_path': parquet_path}
+            route_outputs = get_output_paths(['route'], parquet_path)
+            route_stale = force or is_stage_stale(manifest, 'route', route_inputs, route_parameters, route_outputs)
 
+        if 'schedule' in stage_names:
+            schedule_inputs = get_stage_digests(STOPS_DATA_FILES + [FREQUENCY_TABLE_TO_PATH, FREQUENCY_TABLE_FRO_PATH], [STOPS_SOURCE_FILE, GTFS_SOURCE_FILE, GEO_SOURCE_FILE])
+            schedule_parameters = {'metro_lines': METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT, 'route_ids': ROUTE_ID_LIST, 'metro_speed': METRO_SPEED, 'frequency_based': frequency_based, 'parquet_path': parquet_path}
+            schedule_outputs = get_output_paths(['trips', 'stoptimes'] + (['frequencies'] if frequency_based else []), parquet_path)
+            schedule_stale = force or is_stage_stale(manifest, 'schedule', schedule_inputs, schedule_parameters, schedule_outputs)
 
+        if 'fare' in stage_names:
+            fare_inputs = get_stage_digests(STOPS_DATA_FILES + [SCRAPPED_FARE_PATH, INTERCHANGES_PATH], [STOPS_SOURCE_FILE, NETWORK_SOURCE_FILE, GEO_SOURCE_FILE, FARE_SOURCE_FILE])
+            fare_parameters = {'metro_lines': METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT, 'parquet_path': parquet_path}
+            fare_outputs = get_output_paths(['fare_rule', 'fare_attribute'], parquet_path) + [f'{FARE_MATRIX_PATH}/{file_name}.npy' for file_name in ['stop_ids', 'fare_matrix', 'distance_matrix']]
+            fare_stale = force or is_stage_stale(manifest, 'fare', fare_inputs, fare_parameters, fare_outputs)
 
+    # the line csv files are read once into the stop registry which is shared by every stage that needs the stops
+    if stops_stale or schedule_stale or fare_stale:
+        with profiler.stage('load_stop_registry') as stage:
+            with profiler.stage('import'):
+                from Stops import load_stop_registry
+            stop_registry = load_stop_registry(STOPS_DATA_PATH, METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT)
+            stage.add_rows(len(stop_registry))
 
-def main():
-    # CREATING GTFS
-    METRO_SPEED = 38 # km/h
-    ROUTE_ID_LIST = ['M_PW', 'M_PC', 'M_GM', 'M_GS', 'M_OJ', 'M_OK', 'M_YR', 'M_YB', 'M_SH', 'M_SK', 'M_RK', 'M_RS', 'M_BS', 'M_BK', 'M_PiK', 'M_PiN']
-    METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT = {'M_P': "purple_line",
-                                              'M_G': "green_line",
-                                              'M_O': "orange_line",
-                                              'M_Y': "yellow_line",
-                                              'M_S': "silver_line",
-                                              'M_R': "red_line",
-                                              'M_B': "blue_line",
-                                              'M_Pi': "pink_line"}
-    STOPS_DATA_PATH = f"./stops_data"
-    GTFS_DATA_PATH = f"./GTFS_data"
+    with FeedWriter(GTFS_DATA_PATH, gtfs_zip_path, parquet_path) as feed_writer:
+        # CREATING STOPS FILE
+        if stops_stale:
+            with profiler.stage('stops') as stage:
+                from GTFS import create_stops_file
+                create_stops_file(stop_registry, feed_writer)
+                stage.add_rows(feed_writer.row_counts['stops.csv'])
+            if gtfs_zip_path is None:
+                update_manifest(MANIFEST_PATH, manifest, 'stops', stops_inputs, stops_parameters, stops_outputs)
 
-    FREQUENCY_TABLE_TO_PATH = './frequency_tables/trips time and frequency to.xlsx'
-    FREQUENCY_TABLE_FRO_PATH = './frequency_tables/trips time and frequency fro.xlsx'
+        # CREATING ROUTE FILE
+        if route_stale:
+            with profiler.stage('route') as stage:
+                from GTFS import create_route_file
+                create_route_file(feed_writer, ROUTE_ID_LIST)
+                stage.add_rows(feed_writer.row_counts['route.csv'])
+            if gtfs_zip_path is None:
+                update_manifest(MANIFEST_PATH, manifest, 'route', route_inputs, route_parameters, route_outputs)
 
-    len_purple_line, len_green_line, len_orange_line, len_yellow_line, len_silver_line, len_red_line, len_blue_line, len_pink_line = create_stops_file(STOPS_DATA_PATH, GTFS_DATA_PATH)
+        # CREATING TRIPS AND STOP TIMES FILES
+        if schedule_stale:
+            with profiler.stage('schedule'):
+                create_schedule_files(stop_registry, feed_writer, frequency_based, workers=workers, profiler=profiler)
+            if gtfs_zip_path is None:
+                update_manifest(MANIFEST_PATH, manifest, 'schedule', schedule_inputs, schedule_parameters, schedule_outputs)
 
-    create_route_file(GTFS_DATA_PATH, ROUTE_ID_LIST)
+        # CREATING FARE FILES
+        if fare_stale:
+            with profiler.stage('fare'):
+                create_fare_stage_files(stop_registry, feed_writer, profiler=profiler)
+            if gtfs_zip_path is None:
+                update_manifest(MANIFEST_PATH, manifest, 'fare', fare_inputs, fare_parameters, fare_outputs)
 
-    trips_table = defaultdict(list)
-    trips_table['trip_id'] = []
-    trips_table['route_id'] = []
-    trips_table['arrival time'] = []
-    trips_txt = pd.DataFrame.from_dict(trips_table)
+    if profiler.enabled:
+        print(profiler.summary())
 
-    stop_times_txt = defaultdict(list)
 
-    start_point_of_trip_file = 0
+def get_stage_digests(data_paths, source_files):
+    # the data files are hashed relative to the working directory and the source files relative to the repository,
+    # main.py and Writer.py are inputs of every stage since the stages run the code of main.py and Writer.py formats every file they write
+    return {**get_file_digests(data_paths), **get_file_digests([MAIN_SOURCE_FILE, WRITER_SOURCE_FILE] + source_files, SOURCE_PATH)}
 
-    for route_id in ROUTE_ID_LIST:
-        if route_id in ROUTE_ID_LIST[:len(ROUTE_ID_LIST):2]:
-            trips_frequency_table = pd.read_excel(FREQUENCY_TABLE_TO_PATH)
-            metro_line_id = route_id[:-1]
-            consecutive_station_time_difference = time_gap(stops_data_path=STOPS_DATA_PATH, metro_name=METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT[metro_line_id], metro_speed=METRO_SPEED, reverse=0)
 
+def get_output_paths(table_names, parquet_path=None):
+    # csv files of the tables written by a stage, and their parquet copies if they are written
+    return [f'{GTFS_DATA_PATH}/{table_name}.csv' for table_name in table_names] + ([f'{parquet_path}/{table_name}.parquet' for table_name in table_names] if parquet_path is not None else [])
+
+
+def create_schedule_files(stop_registry, feed_writer, frequency_based=False, metro_speed=METRO_SPEED, workers=1, profiler=None):
+    from concurrent.futures import ProcessPoolExecutor
+
+    from GTFS import create_route_schedule
+    from GTFS import load_frequency_table
+
+    # without a profiler the stages are not measured
+    if profiler is None:
+        profiler = StageProfiler()
+
+    with profiler.stage('load_frequency_table'):
+        frequency_table_to = load_frequency_table(FREQUENCY_TABLE_TO_PATH, FREQUENCY_TABLE_CACHE_PATH)
+        frequency_table_fro = load_frequency_table(FREQUENCY_TABLE_FRO_PATH, FREQUENCY_TABLE_CACHE_PATH)
+
+    route_arguments = [(stop_registry, route_id, ROUTE_ID_LIST, frequency_table_to if route_id in ROUTE_ID_LIST[::2] else frequency_table_fro, metro_speed, frequency_based) for route_id in ROUTE_ID_LIST]
+
+    trips_chunks = []
+    frequencies_chunks = []
+
+    def stop_times_chunks(route_schedules):
+        # the stop times of a route are written as soon as the route is created, only its trips and frequencies are kept for the smaller files
+        # creating the routes (or waiting for the workers creating them) is measured apart from writing their stop times
+        for route_trips_txt, route_stop_times_txt, route_frequencies_txt in profiler.iterate('create_route_schedule', route_schedules):
+            trips_chunks.append(route_trips_txt.drop(columns='arrival time'))
+            frequencies_chunks.append(route_frequencies_txt)
+
+            route_stop_times_txt['departure_time'] = route_stop_times_txt['arrival_time']
+            yield route_stop_times_txt
+
+    # every route is independent of the others, executor.map returns the route tables in route order so the files are the same as a serial run
+    with profiler.stage('write stoptimes.csv') as stage:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                stage.add_rows(feed_writer.write_table('stoptimes.csv', stop_times_chunks(executor.map(create_route_schedule, *zip(*route_arguments)))))
         else:
-            trips_frequency_table = pd.read_excel(FREQUENCY_TABLE_FRO_PATH)
-            metro_line_id = route_id[:-1]
-            consecutive_station_time_difference = time_gap(stops_data_path=STOPS_DATA_PATH, metro_name=METRO_LINE_MAP_TO_METRO_LINE_NAME_DICT[metro_line_id], metro_speed=METRO_SPEED, reverse=1)
+            stage.add_rows(feed_writer.write_table('stoptimes.csv', stop_times_chunks(map(create_route_schedule, *zip(*route_arguments)))))
+
+    with profiler.stage('write trips.csv') as stage:
+        stage.add_rows(feed_writer.write_table('trips.csv', trips_chunks))
+
+    if frequency_based:
+        with profiler.stage('write frequencies.csv') as stage:
+            stage.add_rows(feed_writer.write_table('frequencies.csv', frequencies_chunks))
+    else:
+        # a frequencies file left by an earlier frequency based run would turn the exploded trips into templates
+        feed_writer.remove_table('frequencies.csv')
 
-        trips_txt = pd.concat([trips_txt, create_trips_file(trips_frequency_table, route_id)], ignore_index=True)
 
-        create_stoptimes_file(stop_times_txt,
-                              trips_table=trips_txt,
-                              line_id_str=metro_line_id,
-                              route_id=route_id,
-                              metro_line_time_difference_between_stops=consecutive_station_time_difference,
-                              start_point_of_trip_file=start_point_of_trip_file,
-                              route_id_list=ROUTE_ID_LIST)
-        start_point_of_trip_file = trips_txt.shape[0]
+def create_fare_stage_files(stop_registry, feed_writer, profiler=None):
+    # without a profiler the stages are not measured
+    if profiler is None:
+        profiler = StageProfiler()
 
+    with profiler.stage('import'):
+        from Fare import add_actual_distance_col
+        from Fare import add_haversine_distance_col
+        from Fare import get_old_metro_network
+        from Fare import get_distance_matrix
+        from Fare import linear_regression
+        from Fare import get_new_metro_network
+        from Fare import get_fare_matrix
+        from Fare import iter_fare_file_chunks
+        from Fare import save_fare_matrices
+        from Network import load_interchanges
 
-    stop_times_txt = pd.DataFrame.from_dict(stop_times_txt)
-    stop_times_txt['departure_time'] = stop_times_txt['arrival_time']
+        import pandas as pd
 
-    trips_txt = trips_txt.drop(columns='arrival time')
+    with profiler.stage('read inputs') as stage:
+        interchange_df = load_interchanges(INTERCHANGES_PATH)
+        scrapped_fare_df = pd.read_csv(SCRAPPED_FARE_PATH)
+        stage.add_rows(interchange_df.shape[0] + scrapped_fare_df.shape[0])
 
-    trips_txt.to_csv(f'{GTFS_DATA_PATH}/trips.csv', index=False)
-    stop_times_txt.to_csv(f'{GTFS_DATA_PATH}/stoptimes.csv', index=False)
+    with profiler.stage('add_haversine_distance_col'):
+        scrapped_fare_df, stop_dict = add_haversine_distance_col(scrapped_fare_df, stop_registry)
+    with profiler.stage('build_metro_network'):
+        old_metro_network = get_old_metro_network(stop_registry, interchange_df)
+    with profiler.stage('get_distance_matrix'):
+        old_distance_matrix, old_stop_index = get_distance_matrix(old_metro_network)
+    with profiler.stage('add_actual_distance_col'):
+        scrapped_fare_df = add_actual_distance_col(scrapped_fare_df, stop_dict, old_distance_matrix, old_stop_index)
+    with profiler.stage('linear_regression'):
+        slope, intercept = linear_regression(scrapped_fare_df)
+    with profiler.stage('build_metro_network'):
+        new_metro_network = get_new_metro_network(stop_registry, interchange_df)
 
-    # CREATING FARE FILES
-    stops_df = pd.read_csv(f"{GTFS_DATA_PATH}/stops.csv")
+    with profiler.stage('get_distance_matrix'):
+        new_distance_matrix, new_stop_index = get_distance_matrix(new_metro_network)
 
-    scrapped_fare_df = pd.read_csv("fare_scrapped.csv")
-    scrapped_fare_df, stop_dict = add_haversine_distance_col(scrapped_fare_df, stops_df, len_purple_line, len_green_line)
-    G_old_metro_network = get_old_metro_network(stops_df, len_purple_line, len_green_line)
-    scrapped_fare_df = add_actual_distance_col(scrapped_fare_df, stop_dict, G_old_metro_network)
-    slope, intercept = linear_regression(scrapped_fare_df)
-    G_new_metro_network = get_new_metro_network(stops_df, len_purple_line, len_green_line, len_orange_line, len_yellow_line, len_silver_line, len_red_line, len_blue_line, len_pink_line)
+    with profiler.stage('get_fare_matrix'):
+        fare_matrix = get_fare_matrix(stop_registry, scrapped_fare_df, new_distance_matrix, new_stop_index, slope, intercept)
 
-    fare_rule_df, fare_attribute_df = create_fare_files(stops_df, scrapped_fare_df, G_new_metro_network, slope, intercept)
+    with profiler.stage('save_fare_matrices'):
+        save_fare_matrices(FARE_MATRIX_PATH, stop_registry, fare_matrix, new_distance_matrix, new_stop_index)
 
-    fare_rule_df.to_csv(f"{GTFS_DATA_PATH}/fare_rule.csv", index=False)
-    fare_attribute_df.to_csv(f"{GTFS_DATA_PATH}/fare_attribute.csv", index=False)
+    # the fare tables are written a block of origins at a time, once per table as a zip file takes one member at a time
+    with profiler.stage('write fare_rule.csv') as stage:
+        stage.add_rows(feed_writer.write_table('fare_rule.csv', (fare_rule_chunk for fare_rule_chunk, fare_attribute_chunk in iter_fare_file_chunks(stop_registry.stop_ids, fare_matrix))))
+    with profiler.stage('write fare_attribute.csv') as stage:
+        stage.add_rows(feed_writer.write_table('fare_attribute.csv', (fare_attribute_chunk for fare_rule_chunk, fare_attribute_chunk in iter_fare_file_chunks(stop_registry.stop_ids, fare_matrix))))
 
 
+def add_command_options(parser, command):
+    # options of a subcommand, a subcommand only takes the options of its stages
+    parser.add_argument("--force", action="store_true", help="rebuild the files even if their inputs did not change")
+    parser.add_argument("--parquet", dest="parquet_path", nargs="?", const=PARQUET_DATA_PATH, help=f"also write the files as parquet into this folder (default {PARQUET_DATA_PATH}), needs pyarrow")
+    parser.add_argument("--profile", dest="profile_modes", nargs="?", const="timers",
+                        help="print the time, rows and peak memory of every stage, comma separated modes among timers (default), cprofile and tracemalloc, defaults to the GTFS_PROFILE environment variable")
+    if command in ['schedule', 'all']:
+        parser.add_argument("--frequencies", action="store_true", help="write one template trip per route and a frequencies.csv file instead of every trip")
+        parser.add_argument("--workers", type=int, help="number of worker processes creating the trips and stop times of the routes in parallel (default 1)")
+    if command == 'all':
+        parser.add_argument("--zip", dest="gtfs_zip_path", help="write every file into this zip file instead of the GTFS_data folder")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # the top level parser takes the options of the all subcommand, which is run without a subcommand, with their defaults,
+    # the subcommands take their options without defaults, so an option given before the subcommand is not reset by it
+    parser = argparse.ArgumentParser(description="Generate the GTFS dataset for the Bangalore metro lines.")
+    add_command_options(parser, 'all')
+
+    subparsers = parser.add_subparsers(dest="command", metavar="command", help="stage to run, all when omitted")
+    for command, command_help in [("stops", "write stops.csv"),
+                                  ("routes", "write route.csv"),
+                                  ("schedule", "write trips.csv and stoptimes.csv, and frequencies.csv with --frequencies"),
+                                  ("fares", "write fare_rule.csv, fare_attribute.csv and the fare matrices"),
+                                  ("all", "write every file")]:
+        add_command_options(subparsers.add_parser(command, help=command_help, argument_default=argparse.SUPPRESS), command)
+    parser.set_defaults(command='all', force=False, parquet_path=None, profile_modes=os.environ.get("GTFS_PROFILE"), frequencies=False, workers=1, gtfs_zip_path=None)
+    args = parser.parse_args()
+
+    if args.gtfs_zip_path is not None and args.command != 'all':
+        parser.error("--zip writes every file, it can not be used with a subcommand other than all")
+
+    try:
+        profile_modes = parse_profile_modes(args.profile_modes)
+    except ValueError as error:
+        if args.profile_modes in COMMAND_STAGE_NAMES:
+            # "--profile stops" reads stops as the profile modes, since --profile takes an optional value
+            error = f"{error}, give the subcommand before --profile or the modes as --profile=timers"
+        parser.error(str(error))
+
+    main(frequency_based=args.frequencies, force=args.force, workers=args.workers, gtfs_zip_path=args.gtfs_zip_path,
+         parquet_path=args.parquet_path, profile_modes=profile_modes, stage_names=COMMAND_STAGE_NAMES[args.command])